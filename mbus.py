@@ -4,20 +4,367 @@ import serial
 import serial.tools.list_ports
 import threading
 import time
+import socket
+import socketserver
 import sqlite3
+import io
+import os
+import bisect
+import json
+import sys
+import functools
+import cProfile
+import pstats
+import mmap
+import struct
+import zlib
+import queue
+import multiprocessing
+from collections import deque, OrderedDict
+from contextlib import contextmanager, redirect_stdout
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import numpy as np
 from datetime import datetime, timedelta, date
 from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
 from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
 import calendar
 
 START        = 0x68
 STOP         = 0x16
 CTRL_REQ_UD2 = 0x5B
+CTRL_SND_UD  = 0x53
+ACK          = 0xE5
 NUM_SLAVES   = 8
 BAUDRATE     = 9600
 TIMEOUT      = 2.0
 DB_PATH      = "mbus_data.db"
 POLL_INTERVAL = 5
+BAUD_RATES   = (300, 600, 1200, 2400, 4800, 9600, 19200, 38400)
+BAUD_CI      = {b: 0xB8 + i for i, b in enumerate(BAUD_RATES)}  # EN 13757-3 hız değiştirme CI kodları
+BAUD_DETECT_RETRY = 20  # cevap vermeyen slave için hız tespiti kaç turda bir tekrarlanır
+SPOOL_PATH   = "mbus_spool.bin"
+SPOOL_CAPACITY = 4096  # kayıt; veritabanı uzun süre yazılamazsa dosya büyütülür
+SPOOL_BATCH  = 1000
+SPOOL_DRAIN_INTERVAL = 1.0
+SPOOL_BACKOFF_MAX = 30.0  # aktarım hatalarında yeniden deneme aralığının üst sınırı (sn)
+QUERY_PORT   = int(os.environ.get("MBUS_QUERY_PORT", 0))  # 0: sorgu API'si kapalı
+QUERY_POOL_SIZE = 4
+QUERY_CACHE_SIZE = 256
+STORE_BACKEND = os.environ.get("MBUS_STORE", "sqlite")  # "columnar": geçmiş okumaları kolon deposundan
+COLUMNAR_DIR = "mbus_columns"
+METRICS_PORT = int(os.environ.get("MBUS_METRICS_PORT", 0))  # 0: /metrics sunucusu kapalı
+TRACE_PATH   = os.environ.get("MBUS_TRACE", "")  # dolu ise trace açılışta başlar, çıkışta bu dosyaya yazılır
+TRACE_WINDOW = 20000
+PROFILE_SECONDS = 10
+SERIAL_SETTLE = 2.0  # port açıldıktan sonra cihazın hazır olması için beklenen süre
+TCP_CONNECT_TIMEOUT = 3.0
+TCP_MAX_CONCURRENCY = 1  # gateway başına varsayılan eşzamanlı bağlantı; tcp://host:port?max=N ile değiştirilir
+TCP_BACKOFF_MAX = 30.0
+TCP_GATEWAYS = [g for g in os.environ.get("MBUS_GATEWAYS", "").split(",") if g]  # örn. tcp://10.0.0.5:10001?max=2
+
+# ---- METRİKLER ----
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+class Metrics:
+    # Her yazan thread kendi shard'ına yazar (kilitsiz); okuyucu shard'ların kopyalarını birleştirir.
+    def __init__(self):
+        self.help = {}
+        self.gauges = {}
+        self.shards = []
+        self.local = threading.local()
+
+    def describe(self, name, kind, text):
+        self.help[name] = (kind, text)
+
+    def _shard(self):
+        shard = getattr(self.local, "shard", None)
+        if shard is None:
+            shard = self.local.shard = ({}, {})
+            self.shards.append(shard)
+        return shard
+
+    def inc(self, name, n=1, **labels):
+        counters = self._shard()[0]
+        key = (name, tuple(sorted(labels.items())))
+        counters[key] = counters.get(key, 0) + n
+
+    def observe(self, name, value, **labels):
+        hists = self._shard()[1]
+        key = (name, tuple(sorted(labels.items())))
+        h = hists.get(key)
+        if h is None:
+            h = hists[key] = [0] * (len(LATENCY_BUCKETS) + 2)
+        h[bisect.bisect_left(LATENCY_BUCKETS, value)] += 1
+        h[-1] += value
+
+    def set(self, name, value, **labels):
+        self.gauges[(name, tuple(sorted(labels.items())))] = value
+
+    def snapshot(self):
+        counters, hists = {}, {}
+        for c, h in list(self.shards):
+            for key, v in c.copy().items():
+                counters[key] = counters.get(key, 0) + v
+            for key, v in h.copy().items():
+                acc = hists.setdefault(key, [0] * len(v))
+                for i, x in enumerate(list(v)):
+                    acc[i] += x
+        return counters, hists, self.gauges.copy()
+
+    def render(self):
+        counters, hists, gauges = self.snapshot()
+
+        def fmt_labels(labels, extra=()):
+            items = list(labels) + list(extra)
+            if not items:
+                return ""
+            return "{" + ",".join(f'{k}="{v}"' for k, v in items) + "}"
+
+        by_name = {}
+        for (name, labels), v in sorted(counters.items(), key=lambda kv: repr(kv[0])):
+            by_name.setdefault(name, []).append(f"{name}{fmt_labels(labels)} {v}")
+        for (name, labels), v in sorted(gauges.items(), key=lambda kv: repr(kv[0])):
+            by_name.setdefault(name, []).append(f"{name}{fmt_labels(labels)} {v}")
+        for (name, labels), h in sorted(hists.items(), key=lambda kv: repr(kv[0])):
+            lines = by_name.setdefault(name, [])
+            total = 0
+            for le, cnt in zip(LATENCY_BUCKETS, h):
+                total += cnt
+                lines.append(f"{name}_bucket{fmt_labels(labels, [('le', le)])} {total}")
+            total += h[-2]
+            lines.append(f"{name}_bucket{fmt_labels(labels, [('le', '+Inf')])} {total}")
+            lines.append(f"{name}_sum{fmt_labels(labels)} {h[-1]:.6f}")
+            lines.append(f"{name}_count{fmt_labels(labels)} {total}")
+        out = []
+        for name in sorted(by_name):
+            if name in self.help:
+                kind, text = self.help[name]
+                out.append(f"# HELP {name} {text}")
+                out.append(f"# TYPE {name} {kind}")
+            out.extend(by_name[name])
+        return "\n".join(out) + "\n"
+
+METRICS = Metrics()
+METRICS.describe("mbus_first_byte_seconds", "histogram", "Istekten ilk cevap baytina kadar gecen sure")
+METRICS.describe("mbus_frame_seconds", "histogram", "Istekten tam frame alinana kadar gecen sure")
+METRICS.describe("mbus_sweep_seconds", "histogram", "Tum slave'lerin bir tur sorgulanma suresi")
+METRICS.describe("mbus_db_flush_seconds", "histogram", "Okumanin veritabanina yazilma suresi")
+METRICS.describe("mbus_readings_total", "counter", "Basariyla okunan deger sayisi")
+METRICS.describe("mbus_checksum_errors_total", "counter", "FCS hatali frame sayisi")
+METRICS.describe("mbus_frame_errors_total", "counter", "Cozumlenemeyen frame sayisi")
+METRICS.describe("mbus_timeouts_total", "counter", "Cevap gelmeyen istek sayisi")
+METRICS.describe("mbus_poll_errors_total", "counter", "Sorgu sirasinda olusan hata sayisi")
+METRICS.describe("mbus_last_success_timestamp_seconds", "gauge", "Slave'den son basarili okuma zamani")
+METRICS.describe("mbus_slave_baud", "gauge", "Slave ile konusulan hat hizi")
+METRICS.describe("mbus_ingest_queue_depth", "gauge", "Spool'da veritabanina aktarilmayi bekleyen okuma sayisi")
+METRICS.describe("mbus_spool_drain_errors_total", "counter", "Spool'dan veritabanina aktarim hatasi sayisi")
+METRICS.describe("mbus_spool_corrupt_records_total", "counter", "CRC'si tutmayan spool kaydi sayisi")
+METRICS.describe("mbus_baud_switches_total", "counter", "Hat hizi degisim sayisi")
+METRICS.describe("mbus_baud_probes_total", "counter", "Hiz tespiti icin yapilan deneme sorgulari")
+METRICS.describe("mbus_baud_store_errors_total", "counter", "Hat hizi tablosu okuma/yazma hatasi sayisi")
+
+# ---- TRACE / PROFİL ----
+class _NullSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+NULL_SPAN = _NullSpan()
+
+class _Span:
+    __slots__ = ("tracer", "name", "args", "t0")
+
+    def __init__(self, tracer, name, args):
+        self.tracer = tracer
+        self.name = name
+        self.args = args
+
+    def __enter__(self):
+        self.t0 = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.tracer.add(self.name, self.t0, **self.args)
+        return False
+
+class Tracer:
+    # Kapalıyken span() paylaşılan boş bir context manager döner; açıkken son TRACE_WINDOW span tutulur.
+    def __init__(self, window=TRACE_WINDOW):
+        self.enabled = False
+        self.events = deque(maxlen=window)
+        self.origin = time.perf_counter()
+
+    def start(self):
+        self.events.clear()
+        self.enabled = True
+
+    def stop(self):
+        self.enabled = False
+
+    def span(self, name, **args):
+        if not self.enabled:
+            return NULL_SPAN
+        return _Span(self, name, args)
+
+    def add(self, name, t0, **args):
+        if self.enabled:
+            self.events.append((name, t0, time.perf_counter() - t0, threading.get_ident(), args))
+
+    def to_json(self):
+        pid = os.getpid()
+        names = {t.ident: t.name for t in threading.enumerate()}
+        events = [{"name": "thread_name", "ph": "M", "pid": pid, "tid": tid, "args": {"name": name}}
+                  for tid, name in names.items()]
+        for name, t0, dur, tid, args in list(self.events):
+            events.append({"name": name, "ph": "X", "pid": pid, "tid": tid,
+                           "ts": (t0 - self.origin) * 1e6, "dur": dur * 1e6,
+                           "args": {k: str(v) for k, v in args.items()}})
+        return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+    def dump(self, path):
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.to_json(), f)
+
+TRACER = Tracer()
+
+def traced(name):
+    def deco(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not TRACER.enabled:
+                return fn(*args, **kwargs)
+            with _Span(TRACER, name, {}):
+                return fn(*args, **kwargs)
+        return wrapper
+    return deco
+
+class Profiler:
+    # cProfile yalnızca etkinleştirildiği thread'i ölçer; bu yüzden collector tick() ile kendisi açar/kapatır.
+    # "sample" modu tüm thread'lerin yığınını örnekleyip collapsed-stack metni üretir.
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.job = None
+        self.active = None
+
+    def run(self, seconds, mode="sample"):
+        with self.lock:
+            if mode != "cprofile":
+                return self._sample(seconds)
+            job = {"seconds": seconds, "prof": None, "result": None, "done": threading.Event()}
+            self.job = job
+            if not job["done"].wait(seconds + POLL_INTERVAL + TIMEOUT + 5):
+                if job["prof"] is None:
+                    self.job = None
+                    raise RuntimeError("Collector çalışmıyor, cProfile alınamadı")
+                job["done"].wait()
+            return job["result"]
+
+    def tick(self, final=False):
+        now = time.perf_counter()
+        if self.active is None:
+            job = self.job
+            if final or job is None or job["prof"] is not None:
+                return
+            job["deadline"] = now + job["seconds"]
+            job["prof"] = cProfile.Profile()
+            self.active = job
+            job["prof"].enable()
+        elif final or now >= self.active["deadline"]:
+            job = self.active
+            job["prof"].disable()
+            out = io.StringIO()
+            pstats.Stats(job["prof"], stream=out).sort_stats("cumulative").print_stats(80)
+            job["result"] = out.getvalue()
+            self.active = None
+            if self.job is job:
+                self.job = None
+            job["done"].set()
+
+    def _sample(self, seconds, interval=0.005):
+        me = threading.get_ident()
+        counts = {}
+        end = time.perf_counter() + seconds
+        while time.perf_counter() < end:
+            names = {t.ident: t.name for t in threading.enumerate()}
+            for tid, frame in sys._current_frames().items():
+                if tid == me:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                    frame = frame.f_back
+                key = names.get(tid, str(tid)) + ";" + ";".join(reversed(stack))
+                counts[key] = counts.get(key, 0) + 1
+            time.sleep(interval)
+        return "".join(f"{k} {v}\n" for k, v in sorted(counts.items(), key=lambda kv: -kv[1]))
+
+PROFILER = Profiler()
+
+# ---- YEREL HTTP ----
+class LocalHTTPHandler(BaseHTTPRequestHandler):
+    # routes: path -> fn(query, headers) -> (status, content_type, body, extra_headers)
+    routes = {}
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        fn = self.routes.get(url.path)
+        if fn is None:
+            self.send_error(404)
+            return
+        try:
+            status, ctype, body, extra = fn(parse_qs(url.query), self.headers)
+        except ValueError as ex:
+            status, ctype, body, extra = 400, "text/plain; charset=utf-8", f"{ex}\n".encode(), {}
+        except Exception as ex:
+            status, ctype, body, extra = 500, "text/plain; charset=utf-8", f"{ex}\n".encode(), {}
+        self.send_response(status)
+        if body:
+            self.send_header("Content-Type", ctype)
+        self.send_header("Content-Length", str(len(body)))
+        for k, v in extra.items():
+            self.send_header(k, v)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+def start_http_server(port, routes, host="127.0.0.1"):
+    handler = type("Handler", (LocalHTTPHandler,), {"routes": routes})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def metrics_route(query, headers):
+    return 200, "text/plain; version=0.0.4; charset=utf-8", METRICS.render().encode(), {}
+
+def trace_start_route(query, headers):
+    TRACER.start()
+    return 200, "text/plain; charset=utf-8", b"trace started\n", {}
+
+def trace_route(query, headers):
+    if query.get("stop", ["0"])[0] == "1":
+        TRACER.stop()
+    return 200, "application/json", json.dumps(TRACER.to_json()).encode(), {}
+
+def profile_route(query, headers):
+    seconds = min(float(query.get("seconds", [PROFILE_SECONDS])[0]), 300)
+    mode = query.get("mode", ["sample"])[0]
+    return 200, "text/plain; charset=utf-8", PROFILER.run(seconds, mode).encode(), {}
+
+DEBUG_ROUTES = {
+    "/metrics": metrics_route,
+    "/debug/trace/start": trace_start_route,
+    "/debug/trace": trace_route,
+    "/debug/profile": profile_route,
+}
 
 def calc_checksum(data: bytes) -> int:
     return sum(data) & 0xFF
@@ -29,7 +376,23 @@ def build_request(addr: int) -> bytes:
     frame += bytes([fcs, STOP])
     return bytes(frame)
 
-def parse_long_frame(frame: bytes):
+def build_baud_change(addr: int, baud: int) -> bytes:
+    L = 3
+    frame = bytearray([START, L, L, START, CTRL_SND_UD, addr, BAUD_CI[baud]])
+    fcs = calc_checksum(frame[4:4+L])
+    frame += bytes([fcs, STOP])
+    return bytes(frame)
+
+def line_gap(baud: int) -> float:
+    # iki frame arasında hattın boşta kalması gereken süre (33 bit)
+    return 33 / baud
+
+def response_timeout(baud: int) -> float:
+    # slave cevabı en geç 330 bit + 50 ms içinde başlatmalı
+    return 330 / baud + 0.05
+
+@traced("decode")
+def parse_long_frame(frame: bytes, bus=""):
     if len(frame) < 4 + 2 + 1:
         return None
     if frame[0]!=START or frame[3]!=START or frame[1]!=frame[2]:
@@ -46,6 +409,8 @@ def parse_long_frame(frame: bytes):
     fcs_recv = frame[4+L]
     if calc_checksum(frame[4:4+L]) != fcs_recv:
         print(f"[FCS HATALI] addr={addr}, beklenen={calc_checksum(frame[4:4+L]):02X}, alinan={fcs_recv:02X}")
+        if bus is not None:  # hız tespiti denemeleri (bus=None) sayılmaz
+            METRICS.inc("mbus_checksum_errors_total", bus=bus, slave=addr)
         return None
     scaled = 0
     for i, byte in enumerate(bcd):
@@ -54,13 +419,16 @@ def parse_long_frame(frame: bytes):
         scaled += (hi*10 + lo) * (100**i)
     return addr, scaled/100.0, slave_id_hex
 
-def read_frame(ser: serial.Serial):
+@traced("read_frame")
+def read_frame(ser, timing=None, timeout=TIMEOUT):
     buf = bytearray()
     start_time = time.time()
-    while time.time() - start_time < TIMEOUT:
+    while time.time() - start_time < timeout:
         b = ser.read(1)
         if not b:
             continue
+        if timing is not None and not buf:
+            timing.setdefault("first_byte", time.perf_counter())
         buf += b
         if buf[0] != START:
             buf.pop(0)
@@ -68,7 +436,7 @@ def read_frame(ser: serial.Serial):
         if len(buf) >= 4 and buf[1]==buf[2] and buf[3]==START:
             L = buf[1]
             total_len = 4 + L + 2
-            while len(buf) < total_len and time.time() - start_time < TIMEOUT:
+            while len(buf) < total_len and time.time() - start_time < timeout:
                 chunk = ser.read(total_len - len(buf))
                 if not chunk:
                     break
@@ -76,9 +444,373 @@ def read_frame(ser: serial.Serial):
             return bytes(buf)
     return None
 
+def read_ack(ser, timeout):
+    start_time = time.time()
+    while time.time() - start_time < timeout:
+        b = ser.read(1)
+        if b and b[0] == ACK:
+            return True
+    return False
+
+def build_long_frame(addr: int, value: float, id_bytes: bytes = b"\x00\x00") -> bytes:
+    # parse_long_frame'in tersi: [C, A, CI, id(2), BCD değer(4, düşük bayt önce)]
+    scaled = int(round(value * 100))
+    bcd = bytes((((scaled // 100**i) % 100 // 10) << 4) | ((scaled // 100**i) % 10) for i in range(4))
+    payload = bytes([0x08, addr, 0x72]) + id_bytes[:2] + bcd
+    L = len(payload)
+    return bytes([START, L, L, START]) + payload + bytes([calc_checksum(payload), STOP])
+
+# ---- TRANSPORT ----
+class SerialTransport:
+    supports_baud = True
+
+    def __init__(self, port, baudrate=BAUDRATE):
+        self.name = port
+        self.ser = serial.Serial(port, baudrate, timeout=0.5)
+        self.ready_at = time.monotonic() + SERIAL_SETTLE
+
+    def _wait_ready(self):
+        delay = self.ready_at - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+
+    @property
+    def baudrate(self):
+        return self.ser.baudrate
+
+    def set_baudrate(self, baud):
+        if self.ser.baudrate != baud:
+            self.ser.baudrate = baud
+
+    def read(self, n):
+        return self.ser.read(n)
+
+    def write(self, data):
+        self._wait_ready()
+        return self.ser.write(data)
+
+    def reset_input_buffer(self):
+        # cihaz hazır olana kadar gönderdiği gürültü de temizlensin
+        self._wait_ready()
+        self.ser.reset_input_buffer()
+
+    def release(self):
+        pass
+
+    def close(self):
+        self.ser.close()
+
+class TcpGateway:
+    # Bir gateway'e açılan kalıcı soketlerin havuzu. max_conns eşzamanlı kullanımı sınırlar
+    # (gateway başına ayarlanabilir); bağlantı hatalarında yeniden deneme üstel olarak geciktirilir.
+    def __init__(self, host, port, max_conns=TCP_MAX_CONCURRENCY):
+        self.host = host
+        self.port = port
+        self.max_conns = max_conns
+        self.busy = 0
+        self.cond = threading.Condition()
+        self.idle = []
+        self.failures = 0
+        self.next_try = 0.0
+
+    def _connect(self):
+        # bağlantı kilit dışında kurulur; geri çekilme durumu kilit altında okunur/güncellenir
+        now = time.monotonic()
+        with self.cond:
+            if now < self.next_try:
+                raise ConnectionError(f"{self.host}:{self.port} için yeniden bağlanma {self.next_try - now:.1f} sn sonra")
+        try:
+            sock = socket.create_connection((self.host, self.port), timeout=TCP_CONNECT_TIMEOUT)
+        except OSError:
+            with self.cond:
+                self.failures += 1
+                self.next_try = now + min(TCP_BACKOFF_MAX, 0.5 * 2 ** self.failures)
+            raise
+        with self.cond:
+            self.failures = 0
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+        sock.settimeout(0.5)
+        return sock
+
+    def set_limit(self, max_conns):
+        with self.cond:
+            self.max_conns = max_conns
+            self.cond.notify_all()
+
+    def _free_slot(self):
+        with self.cond:
+            self.busy -= 1
+            self.cond.notify()
+
+    def acquire(self):
+        with self.cond:
+            while self.busy >= self.max_conns:
+                self.cond.wait()
+            self.busy += 1
+            if self.idle:
+                return self.idle.pop()
+        try:
+            return self._connect()
+        except Exception:
+            self._free_slot()
+            raise
+
+    def release(self, sock, broken=False):
+        if broken:
+            try:
+                sock.close()
+            except OSError:
+                pass
+            self._free_slot()
+            return
+        with self.cond:
+            self.idle.append(sock)
+            self.busy -= 1
+            self.cond.notify()
+
+    def close(self):
+        with self.cond:
+            socks, self.idle = self.idle, []
+        for sock in socks:
+            sock.close()
+
+_gateways = {}
+_gateways_lock = threading.Lock()
+
+def get_gateway(host, port, max_conns=None):
+    # max_conns verilmezse mevcut gateway'in sınırı (yoksa TCP_MAX_CONCURRENCY) korunur
+    with _gateways_lock:
+        gw = _gateways.get((host, port))
+        if gw is None:
+            gw = _gateways[(host, port)] = TcpGateway(host, port, max_conns or TCP_MAX_CONCURRENCY)
+        elif max_conns and max_conns != gw.max_conns:
+            gw.set_limit(max_conns)
+        return gw
+
+class TcpTransport:
+    # Şeffaf (raw socket) Ethernet/M-Bus gateway. Soket havuzdan ilk kullanımda alınır,
+    # release() ile havuza geri verilir; bağlantı koparsa bir sonraki istekte yeniden açılır.
+    # Hat hızı gateway'de sabittir, bu yüzden baud müzakeresi yapılmaz.
+    supports_baud = False
+    baudrate = BAUDRATE
+
+    def __init__(self, host, port, max_conns=None):
+        self.name = f"tcp://{host}:{port}"
+        self.gateway = get_gateway(host, port, max_conns)
+        self.sock = None
+        self.rx = b""
+
+    def _sock(self):
+        if self.sock is None:
+            self.sock = self.gateway.acquire()
+        return self.sock
+
+    def _drop(self):
+        if self.sock is not None:
+            self.gateway.release(self.sock, broken=True)
+            self.sock = None
+        self.rx = b""
+
+    def read(self, n):
+        if not self.rx:
+            sock = self._sock()
+            try:
+                data = sock.recv(4096)
+            except socket.timeout:
+                return b""
+            except OSError:
+                self._drop()
+                raise
+            if not data:
+                self._drop()
+                raise ConnectionError(f"{self.name} bağlantıyı kapattı")
+            self.rx = data
+        out, self.rx = self.rx[:n], self.rx[n:]
+        return out
+
+    def write(self, data):
+        try:
+            self._sock().sendall(data)
+        except OSError:
+            self._drop()
+            raise
+        return len(data)
+
+    def reset_input_buffer(self):
+        # Havuzdaki soket karşı taraftan kapatılmış olabilir: bir kez yeni bağlantıyla tekrar dene.
+        self.rx = b""
+        for attempt in range(2):
+            sock = self._sock()
+            try:
+                sock.setblocking(False)
+                while sock.recv(4096):
+                    pass
+                raise ConnectionError(f"{self.name} bağlantıyı kapattı")
+            except (BlockingIOError, InterruptedError):
+                sock.settimeout(0.5)
+                return
+            except OSError:
+                self._drop()
+                if attempt:
+                    raise
+
+    def set_baudrate(self, baud):
+        pass
+
+    def release(self):
+        if self.sock is not None:
+            self.gateway.release(self.sock)
+            self.sock = None
+        self.rx = b""
+
+    def close(self):
+        self.release()
+
+class SimTransport:
+    # Süreç içi simüle M-Bus hattı: baytların süresi hat hızına göre beklenir ve
+    # yalnızca hattın hızında dinleyen slave cevap verir (baud müzakeresini test etmek için).
+    supports_baud = True
+
+    def __init__(self, slaves, baudrate=BAUDRATE, timeout=0.5):
+        self.name = f"sim://{len(slaves)}"
+        self.slaves = {s.addr: s for s in slaves}
+        self.baudrate = baudrate
+        self.timeout = timeout
+        self.rx = b""
+        self.rx_ready = 0.0
+
+    def set_baudrate(self, baud):
+        self.baudrate = baud
+
+    def write(self, data):
+        time.sleep(len(data) * 11 / self.baudrate)
+        if len(data) >= 6 and data[0] == START and data[3] == START:
+            L = data[1]
+            payload = data[4:4+L]
+            slave = self.slaves.get(payload[1]) if L >= 2 else None
+            if slave and slave.baud == self.baudrate and len(data) == 4 + L + 2 and calc_checksum(payload) == data[4+L]:
+                reply = slave.respond(payload[0], payload[2:])
+                if reply:
+                    self.rx += reply
+                    self.rx_ready = time.monotonic() + (11 + len(reply) * 11) / self.baudrate
+                slave.after_reply()
+        return len(data)
+
+    def read(self, n):
+        if not self.rx:
+            time.sleep(self.timeout)
+            return b""
+        delay = self.rx_ready - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+        out, self.rx = self.rx[:n], self.rx[n:]
+        return out
+
+    def reset_input_buffer(self):
+        self.rx = b""
+
+    def release(self):
+        pass
+
+    def close(self):
+        pass
+
+def make_sim_slaves(n):
+    # farklı hız desteği olan örnek bir hat; 300 baud'luk eski sayaç dahil
+    max_rates = (38400, 19200, 9600, 2400, 38400, 4800, 19200, 300)
+    return [SimulatedSlave(a, value=100.0 * a, max_baud=max_rates[(a - 1) % len(max_rates)])
+            for a in range(1, n + 1)]
+
+def open_transport(spec):
+    if spec.startswith("sim://"):
+        return SimTransport(make_sim_slaves(int(spec[6:] or NUM_SLAVES)))
+    if spec.startswith("tcp://"):
+        addr, _, query = spec[6:].partition("?")
+        host, _, port = addr.rpartition(":")
+        opts = parse_qs(query)
+        max_conns = opts.get("max", ["0"])[-1]
+        if not host or not port.isdigit() or not max_conns.isdigit() or set(opts) - {"max"}:
+            raise ValueError(f"Geçersiz gateway adresi: {spec} (tcp://host:port[?max=N])")
+        return TcpTransport(host, int(port), int(max_conns) or None)
+    return SerialTransport(spec)
+
+# ---- SİMÜLATÖR ----
+class SimulatedSlave:
+    def __init__(self, addr, value=0.0, id_bytes=None, max_baud=BAUDRATE):
+        self.addr = addr
+        self.value = value
+        self.id_bytes = id_bytes or bytes([0x10, addr])
+        self.max_baud = max_baud
+        self.baud = min(max_baud, BAUDRATE)
+        self.pending_baud = None
+
+    def respond(self, ctrl, payload):
+        if ctrl == CTRL_REQ_UD2:
+            self.value += 0.01 * self.addr
+            return build_long_frame(self.addr, self.value, self.id_bytes)
+        if ctrl == CTRL_SND_UD and payload:
+            rate = {ci: b for b, ci in BAUD_CI.items()}.get(payload[0])
+            if rate and rate <= self.max_baud:
+                self.pending_baud = rate
+                return bytes([ACK])
+        return None
+
+    def after_reply(self):
+        # hız değişikliği ACK eski hızda gönderildikten sonra uygulanır
+        if self.pending_baud:
+            self.baud, self.pending_baud = self.pending_baud, None
+
+class _SimulatorHandler(socketserver.BaseRequestHandler):
+    def handle(self):
+        buf = bytearray()
+        while True:
+            try:
+                data = self.request.recv(4096)
+            except OSError:
+                return
+            if not data:
+                return
+            buf += data
+            while True:
+                while buf and buf[0] != START:
+                    buf.pop(0)
+                if len(buf) < 4:
+                    break
+                L = buf[1]
+                total = 4 + L + 2
+                if len(buf) < total:
+                    break
+                frame, buf = bytes(buf[:total]), buf[total:]
+                payload = frame[4:4+L]
+                if L < 2 or calc_checksum(payload) != frame[4+L]:
+                    continue
+                slave = self.server.slaves.get(payload[1])
+                if not slave or slave.baud != BAUDRATE:
+                    continue
+                reply = slave.respond(payload[0], payload[2:])
+                if reply:
+                    time.sleep(len(reply) * 11 / BAUDRATE)
+                    self.request.sendall(reply)
+                slave.after_reply()
+
+class MBusSimulator(socketserver.ThreadingTCPServer):
+    # Şeffaf TCP gateway arkasındaki bir M-Bus hattını taklit eder (test ve geliştirme için).
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, port=0, num_slaves=NUM_SLAVES, host="127.0.0.1"):
+        super().__init__((host, port), _SimulatorHandler)
+        self.slaves = {a: SimulatedSlave(a, value=100.0 * a) for a in range(1, num_slaves + 1)}
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
 def init_db():
     conn = sqlite3.connect(DB_PATH)
     cur = conn.cursor()
+    cur.execute("PRAGMA journal_mode=WAL")
     cur.execute("""
         CREATE TABLE IF NOT EXISTS readings (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -87,18 +819,234 @@ def init_db():
             value REAL
         )
     """)
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS spool_state (
+            id INTEGER PRIMARY KEY CHECK (id = 0),
+            last_seq INTEGER
+        )
+    """)
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS slave_baud (
+            bus TEXT,
+            slave_id INTEGER,
+            baud INTEGER,
+            updated TEXT,
+            PRIMARY KEY (bus, slave_id)
+        )
+    """)
     conn.commit()
     conn.close()
 
-def insert_reading(slave_id, value):
+def load_spool_seq():
     conn = sqlite3.connect(DB_PATH)
     cur = conn.cursor()
-    cur.execute(
-        "INSERT INTO readings (timestamp, slave_id, value) VALUES (?, ?, ?)",
-        (datetime.now().isoformat(), slave_id, value)
-    )
-    conn.commit()
+    cur.execute("SELECT last_seq FROM spool_state WHERE id = 0")
+    row = cur.fetchone()
+    conn.close()
+    return row[0] if row else 0
+
+@traced("ingest")
+def insert_readings(conn, records):
+    # records: [(seq, epoch, slave_id, value)]; spool'un son seq'i aynı transaction'da saklanır,
+    # böylece çökme sonrası tekrar aktarılan kayıtlar atlanır.
+    t0 = time.perf_counter()
+    cur = conn.cursor()
+    cur.execute("SELECT last_seq FROM spool_state WHERE id = 0")
+    row = cur.fetchone()
+    last_seq = row[0] if row else 0
+    rows = [(datetime.fromtimestamp(epoch).isoformat(), sid, value)
+            for seq, epoch, sid, value in records if seq > last_seq]
+    with conn:
+        conn.executemany("INSERT INTO readings (timestamp, slave_id, value) VALUES (?, ?, ?)", rows)
+        conn.execute("INSERT OR REPLACE INTO spool_state (id, last_seq) VALUES (0, ?)",
+                     (max(last_seq, records[-1][0]),))
+    METRICS.observe("mbus_db_flush_seconds", time.perf_counter() - t0)
+    return len(rows)
+
+# ---- SPOOL ----
+class ReadingSpool:
+    # Okumaların önce yazıldığı, mmap'li, yalnızca sona eklenen dosya. Başlıkta head/tail kayıt
+    # indeksleri ve sıradaki seq tutulur; her kaydın kendi CRC32'si vardır. Başlık yazılmadan
+    # çökülürse tail'den sonraki geçerli ve ardışık kayıtlar açılışta geri kazanılır.
+    MAGIC = b"MBSP"
+    HEADER = struct.Struct("<4sIQQQ")  # magic, sürüm, head, tail, sıradaki seq
+    BODY = struct.Struct("<QdId")      # seq, epoch, slave_id, value
+    RECORD_SIZE = BODY.size + 4        # + crc32
+
+    def __init__(self, path=SPOOL_PATH, start_seq=1, capacity=SPOOL_CAPACITY):
+        self.path = path
+        self.min_capacity = capacity
+        self.lock = threading.Lock()
+        fresh = not os.path.exists(path) or os.path.getsize(path) < self.HEADER.size + self.RECORD_SIZE
+        self.f = open(path, "w+b" if fresh else "r+b")
+        if fresh:
+            self.f.truncate(self.HEADER.size + capacity * self.RECORD_SIZE)
+        self._map()
+        magic, version, head, tail, next_seq = self.HEADER.unpack_from(self.mm, 0)
+        if magic != self.MAGIC or version != 1 or not head <= tail <= self.capacity:
+            head = tail = 0
+            next_seq = 0
+        self.head, self.tail = head, tail
+        self.next_seq = max(next_seq, start_seq)
+        self._recover(next_seq)
+
+    def _map(self):
+        self.f.flush()
+        size = os.fstat(self.f.fileno()).st_size
+        self.capacity = (size - self.HEADER.size) // self.RECORD_SIZE
+        self.mm = mmap.mmap(self.f.fileno(), 0)
+
+    def _resize(self, capacity):
+        self.mm.close()
+        self.f.truncate(self.HEADER.size + capacity * self.RECORD_SIZE)
+        self._map()
+
+    def _record(self, index):
+        off = self.HEADER.size + index * self.RECORD_SIZE
+        raw = self.mm[off:off + self.RECORD_SIZE]
+        body, (crc,) = raw[:self.BODY.size], struct.unpack("<I", raw[self.BODY.size:])
+        if zlib.crc32(body) != crc:
+            return None
+        return self.BODY.unpack(body)
+
+    def _recover(self, expected):
+        # expected == 0 ise başlık geçersizdir: ilk geçerli kayıttan itibaren ardışık olanlar alınır
+        while self.tail < self.capacity:
+            rec = self._record(self.tail)
+            if rec is None or (expected and rec[0] != expected):
+                break
+            self.tail += 1
+            expected = rec[0] + 1
+        self.next_seq = max(self.next_seq, expected)
+        self._write_header()
+
+    def _write_header(self):
+        self.HEADER.pack_into(self.mm, 0, self.MAGIC, 1, self.head, self.tail, self.next_seq)
+        self.mm.flush()
+
+    def pending(self):
+        return self.tail - self.head
+
+    @traced("spool")
+    def append(self, slave_id, value, epoch=None):
+        with self.lock:
+            if self.tail >= self.capacity:
+                self._resize(self.capacity * 2)
+            body = self.BODY.pack(self.next_seq, epoch or time.time(), slave_id, value)
+            off = self.HEADER.size + self.tail * self.RECORD_SIZE
+            self.mm[off:off + self.RECORD_SIZE] = body + struct.pack("<I", zlib.crc32(body))
+            self.tail += 1
+            self.next_seq += 1
+            self._write_header()
+            return self.tail - self.head
+
+    def read_batch(self, limit=SPOOL_BATCH):
+        with self.lock:
+            end = min(self.tail, self.head + limit)
+            indexes = range(self.head, end)
+            records = [self._record(i) for i in indexes]
+        valid = [r for r in records if r is not None]
+        if len(valid) != len(records):
+            METRICS.inc("mbus_spool_corrupt_records_total", len(records) - len(valid))
+        return valid, end
+
+    def commit(self, end):
+        with self.lock:
+            self.head = end
+            if self.head >= self.tail:
+                self.head = self.tail = 0
+                if self.capacity > self.min_capacity:
+                    self._resize(self.min_capacity)
+            self._write_header()
+
+    def close(self):
+        with self.lock:
+            self.mm.close()
+            self.f.close()
+
+class SpoolDrainer:
+    # Spool'daki kayıtları arka planda toplu olarak veritabanına taşır; veritabanı kilitli ya da
+    # erişilemezse (veya başka bir hata olursa) kayıtlar spool'da kalır ve artan aralıklarla
+    # yeniden denenir. Aktarım seq ve zaman damgasıyla tekrarlanabilir olduğundan yarım kalan
+    # bir deneme çift kayıt üretmez.
+    def __init__(self, spool):
+        self.spool = spool
+        self.wake = threading.Event()
+        self.running = False
+
+    def start(self):
+        self.running = True
+        threading.Thread(target=self.run, name="spool-drainer", daemon=True).start()
+        return self
+
+    def stop(self):
+        self.running = False
+        self.wake.set()
+
+    def drain_once(self, conn):
+        records, end = self.spool.read_batch()
+        if end == self.spool.head:
+            return False
+        if records:
+            # kolon deposu SQLite'tan önce yazılır: sorgu API'sinin ETag'i (MAX(readings.id))
+            # ilerlediğinde seri verisi zaten yerindedir
+            if COLUMNAR is not None:
+                COLUMNAR.append_records(records)
+            insert_readings(conn, records)
+        self.spool.commit(end)
+        METRICS.set("mbus_ingest_queue_depth", self.spool.pending())
+        return True
+
+    def run(self):
+        conn = None
+        failures = 0
+        retry_at = 0.0
+        while self.running:
+            self.wake.wait(SPOOL_DRAIN_INTERVAL)
+            self.wake.clear()
+            if time.monotonic() < retry_at:
+                continue
+            try:
+                if conn is None:
+                    conn = sqlite3.connect(DB_PATH, timeout=5)
+                while self.drain_once(conn):
+                    pass
+                failures = 0
+            except Exception as ex:
+                failures += 1
+                retry_at = time.monotonic() + min(SPOOL_BACKOFF_MAX, SPOOL_DRAIN_INTERVAL * 2 ** failures)
+                METRICS.inc("mbus_spool_drain_errors_total")
+                print(f"Spool aktarım hatası: {ex}")
+                if conn is not None:
+                    conn.close()
+                conn = None
+
+def load_slave_bauds(bus):
+    conn = sqlite3.connect(DB_PATH)
+    cur = conn.cursor()
+    cur.execute("SELECT slave_id, baud FROM slave_baud WHERE bus = ?", (bus,))
+    rows = dict(cur.fetchall())
     conn.close()
+    return rows
+
+def save_slave_bauds(bus, changes):
+    # changes: {slave_id: baud | None}; tek işlemde yazılır. Sorgu iş parçacığından çağrıldığı
+    # için kilitli veritabanında uzun beklemez, hata çağırana bırakılır (bir sonraki turda tekrar denenir).
+    conn = sqlite3.connect(DB_PATH, timeout=1)
+    try:
+        cur = conn.cursor()
+        now = datetime.now().isoformat()
+        for slave_id, baud in changes.items():
+            if baud is None:
+                cur.execute("DELETE FROM slave_baud WHERE bus = ? AND slave_id = ?", (bus, slave_id))
+            else:
+                cur.execute(
+                    "INSERT OR REPLACE INTO slave_baud (bus, slave_id, baud, updated) VALUES (?, ?, ?, ?)",
+                    (bus, slave_id, baud, now)
+                )
+        conn.commit()
+    finally:
+        conn.close()
 
 def fetch_trend(days=7):
     conn = sqlite3.connect(DB_PATH)
@@ -158,9 +1106,876 @@ def fetch_latest_slave_readings():
     conn.close()
     return rows
 
+# ---- SORGU API ----
+AGGREGATE_FORMATS = {"hour": "%Y-%m-%d %H:00", "day": "%Y-%m-%d", "month": "%Y-%m"}
+
+def query_latest(conn, query):
+    cur = conn.execute("""
+        SELECT slave_id, value, MAX(timestamp)
+        FROM readings
+        GROUP BY slave_id
+        ORDER BY slave_id
+    """)
+    return [{"slave_id": sid, "value": value, "timestamp": ts} for sid, value, ts in cur]
+
+def time_param(query, name):
+    # "YYYY", "YYYY-MM", "YYYY-MM-DD" ya da ISO 8601 zaman; verilmezse None. Her iki depo
+    # da aynı sınırı kullanır (ör. start=2026-10 -> 2026-10-01T00:00:00).
+    if name not in query:
+        return None
+    text = query[name][0]
+    for fmt in ("%Y", "%Y-%m"):
+        try:
+            return datetime.strptime(text, fmt)
+        except ValueError:
+            pass
+    try:
+        value = datetime.fromisoformat(text)
+    except ValueError:
+        raise ValueError(f"{name} geçersiz: {text} (YYYY, YYYY-MM, YYYY-MM-DD ya da ISO 8601)") from None
+    if value.tzinfo is not None:
+        value = value.astimezone().replace(tzinfo=None)
+    return value
+
+def time_bounds(query):
+    # SQLite sorguları için ISO metin sınırları; açık uçlar tüm kayıtları kapsar
+    start, end = time_param(query, "start"), time_param(query, "end")
+    return (start.isoformat() if start else "0000"), (end.isoformat() if end else "9999")
+
+def query_series(conn, query):
+    if "slave" not in query:
+        raise ValueError("slave parametresi gerekli")
+    sid = int(query["slave"][0])
+    start, end = time_param(query, "start"), time_param(query, "end")
+    t, v = fetch_slave_series(sid, start and start.timestamp(), end and end.timestamp(), conn)
+    return {"slave_id": sid,
+            "points": [[datetime.fromtimestamp(x).isoformat(), y] for x, y in zip(t.tolist(), v.tolist())]}
+
+def query_aggregate(conn, query):
+    period = query.get("period", ["day"])[0]
+    if period not in AGGREGATE_FORMATS:
+        raise ValueError(f"period şunlardan biri olmalı: {', '.join(AGGREGATE_FORMATS)}")
+    start, end = time_bounds(query)
+    sql = """
+        SELECT strftime(?, timestamp) AS bucket, slave_id, SUM(value)
+        FROM readings
+        WHERE timestamp >= ? AND timestamp < ?
+    """
+    params = [AGGREGATE_FORMATS[period], start, end]
+    if "slave" in query:
+        sql += " AND slave_id = ?"
+        params.append(int(query["slave"][0]))
+    sql += " GROUP BY bucket, slave_id ORDER BY bucket, slave_id"
+    return [{"bucket": b, "slave_id": sid, "total": total} for b, sid, total in conn.execute(sql, params)]
+
+class ReadPool:
+    # WAL modunda salt-okunur bağlantı havuzu; okuyucular collector'ın yazmasını bekletmez.
+    def __init__(self, path=DB_PATH, size=QUERY_POOL_SIZE):
+        self.conns = queue.Queue()
+        for _ in range(size):
+            conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True, check_same_thread=False, timeout=5)
+            conn.execute("PRAGMA query_only=1")
+            self.conns.put(conn)
+
+    @contextmanager
+    def connection(self):
+        conn = self.conns.get()
+        try:
+            yield conn
+        finally:
+            self.conns.put(conn)
+
+class QueryAPI:
+    # Yanıtlar, veri yüksek su işareti (readings.id'nin en büyüğü) ve sorgu parametrelerinden
+    # üretilen ETag ile önbelleğe alınır; If-None-Match eşleşirse sorgu hiç çalıştırılmaz.
+    def __init__(self, path=DB_PATH, pool_size=QUERY_POOL_SIZE):
+        self.pool = ReadPool(path, pool_size)
+        self.cache = OrderedDict()
+        self.cache_lock = threading.Lock()
+
+    def routes(self):
+        return {
+            "/api/latest": self._route(query_latest),
+            "/api/series": self._route(query_series),
+            "/api/aggregate": self._route(query_aggregate),
+        }
+
+    def _route(self, fn):
+        def route(query, headers):
+            key = (fn.__name__,) + tuple(sorted((k, tuple(v)) for k, v in query.items()))
+            with self.pool.connection() as conn:
+                hwm = conn.execute("SELECT MAX(id) FROM readings").fetchone()[0] or 0
+                etag = f'"{hwm:x}-{zlib.crc32(repr(key).encode()):08x}"'
+                extra = {"ETag": etag, "Cache-Control": "no-cache"}
+                if headers.get("If-None-Match") == etag:
+                    return 304, "", b"", extra
+                with self.cache_lock:
+                    hit = self.cache.get(key)
+                    if hit and hit[0] == etag:
+                        self.cache.move_to_end(key)
+                        return 200, "application/json", hit[1], extra
+                body = json.dumps(fn(conn, query), ensure_ascii=False).encode()
+            with self.cache_lock:
+                self.cache[key] = (etag, body)
+                self.cache.move_to_end(key)
+                while len(self.cache) > QUERY_CACHE_SIZE:
+                    self.cache.popitem(last=False)
+            return 200, "application/json", body, extra
+        return route
+
+def start_query_api(port):
+    init_db()
+    return start_http_server(port, QueryAPI().routes())
+
+# ---- HAT SORGULAMA ----
+def poll_slave(ser, addr, bus, timeout=TIMEOUT, probe=False):
+    # (addr, değer, slave id, epoch) | None: cevap yok | False: bozuk frame
+    # Hat boşluğu istekten önce beklenir; okuma yazmanın hemen ardından başlar ki
+    # ilk bayt süresi sabit bir bekleme değil gerçek cevap gecikmesi olsun.
+    # epoch frame'in alındığı andır; okuma tur sonunda değil bu zamanla saklanır.
+    # probe: hız tespiti denemesi; yanlış hızdaki sessizlik beklenen durumdur, bu yüzden
+    # gecikme/hata metriklerine değil yalnızca mbus_baud_probes_total'a sayılır.
+    time.sleep(line_gap(ser.baudrate))
+    ser.reset_input_buffer()
+    req = build_request(addr)
+    sent = time.perf_counter()
+    ser.write(req)
+    timing = {}
+    frame = read_frame(ser, timing, timeout)
+    received = time.time()
+    if probe:
+        res = parse_long_frame(frame, None) if frame else None
+        METRICS.inc("mbus_baud_probes_total", bus=bus, baud=ser.baudrate,
+                    result="ok" if res else "error" if frame else "timeout")
+        if not frame:
+            return None
+        return res + (received,) if res else False
+    if "first_byte" in timing:
+        METRICS.observe("mbus_first_byte_seconds", timing["first_byte"] - sent, bus=bus, slave=addr)
+    if not frame:
+        METRICS.inc("mbus_timeouts_total", bus=bus, slave=addr)
+        return None
+    METRICS.observe("mbus_frame_seconds", time.perf_counter() - sent, bus=bus, slave=addr)
+    print("GELEN FRAME:", frame.hex())
+    res = parse_long_frame(frame, bus)
+    if not res:
+        METRICS.inc("mbus_frame_errors_total", bus=bus, slave=addr)
+        return False
+    return res + (received,)
+
+class BusPoller:
+    # Bir hattaki slave'leri sorgular. Hız değiştirebilen hatlarda her slave'in hızını tespit edip
+    # en yükseğe çıkarır, saklar ve sorguları hıza göre gruplayarak hız değişimini en aza indirir.
+    def __init__(self, ser, addrs):
+        self.ser = ser
+        self.bus = ser.name
+        self.addrs = list(addrs)
+        self.bauds = {}
+        self.unsaved = {}  # veritabanına henüz yazılamamış hız değişiklikleri
+        if ser.supports_baud:
+            try:
+                self.bauds = load_slave_bauds(self.bus)
+            except sqlite3.Error as ex:
+                # kayıtlı hızlar okunamazsa slave'ler yeniden tespit edilir
+                METRICS.inc("mbus_baud_store_errors_total", bus=self.bus)
+                print(f"Hat hızları okunamadı ({self.bus}): {ex}")
+        self.misses = {}
+        self.detect_after = {}
+        self.sweeps = 0
+
+    def baud_of(self, addr):
+        return self.bauds.get(addr, BAUDRATE)
+
+    def _set_baud(self, baud):
+        if self.ser.baudrate != baud:
+            self.ser.set_baudrate(baud)
+            METRICS.inc("mbus_baud_switches_total", bus=self.bus)
+
+    def _store(self, addr, baud):
+        if baud is None:
+            self.bauds.pop(addr, None)
+        else:
+            self.bauds[addr] = baud
+            METRICS.set("mbus_slave_baud", baud, bus=self.bus, slave=addr)
+        self.unsaved[addr] = baud
+
+    def _flush(self):
+        # hız tablosu bellekte tutulur; veritabanı yazılamazsa değişiklikler sonraki turda tekrar denenir
+        if not self.unsaved:
+            return
+        changes, self.unsaved = self.unsaved, {}
+        try:
+            save_slave_bauds(self.bus, changes)
+        except sqlite3.Error as ex:
+            self.unsaved = {**changes, **self.unsaved}
+            METRICS.inc("mbus_baud_store_errors_total", bus=self.bus)
+            print(f"Hat hızları kaydedilemedi ({self.bus}): {ex}")
+
+    def _switch(self, addr, old, new):
+        self._set_baud(old)
+        self.ser.reset_input_buffer()
+        self.ser.write(build_baud_change(addr, new))
+        if not read_ack(self.ser, response_timeout(old)):
+            return False
+        self._set_baud(new)
+        if poll_slave(self.ser, addr, self.bus, response_timeout(new) + 0.2, probe=True):
+            return True
+        # slave yeni hıza geçti ama okunamadı: eski hıza geri al
+        self.ser.reset_input_buffer()
+        self.ser.write(build_baud_change(addr, old))
+        read_ack(self.ser, response_timeout(new))
+        self._set_baud(old)
+        return False
+
+    @traced("detect_baud")
+    def detect(self, addr):
+        current = None
+        for rate in sorted(BAUD_RATES, key=lambda r: (r != BAUDRATE, -r)):
+            self._set_baud(rate)
+            if poll_slave(self.ser, addr, self.bus, response_timeout(rate) + 0.2, probe=True):
+                current = rate
+                break
+        if current is None:
+            self.detect_after[addr] = self.sweeps + BAUD_DETECT_RETRY
+            return
+        for rate in sorted((r for r in BAUD_RATES if r > current), reverse=True):
+            if self._switch(addr, current, rate):
+                current = rate
+                break
+        self._store(addr, current)
+
+    def sweep(self):
+        bus = self.bus
+        sweep_start = time.perf_counter()
+        results = {}
+        try:
+            if self.ser.supports_baud:
+                for addr in self.addrs:
+                    if addr not in self.bauds and self.detect_after.get(addr, 0) <= self.sweeps:
+                        try:
+                            self.detect(addr)
+                        except Exception as ex:
+                            METRICS.inc("mbus_poll_errors_total", bus=bus, slave=addr)
+                            print(f"Slave {addr} hız tespiti hatası: {ex}")
+                            self.detect_after[addr] = self.sweeps + 1
+                order = sorted(self.addrs, key=lambda a: (-self.baud_of(a), a))
+            else:
+                order = self.addrs
+            for addr in order:
+                PROFILER.tick()
+                slave_start = time.perf_counter()
+                try:
+                    if self.ser.supports_baud:
+                        self._set_baud(self.baud_of(addr))
+                    res = poll_slave(self.ser, addr, bus)
+                except Exception as ex:
+                    METRICS.inc("mbus_poll_errors_total", bus=bus, slave=addr)
+                    print(f"Slave {addr} hata: {ex}")
+                    res = False
+                if res:
+                    self.misses[addr] = 0
+                    METRICS.inc("mbus_readings_total", bus=bus, slave=res[0])
+                    METRICS.set("mbus_last_success_timestamp_seconds", res[3], bus=bus, slave=res[0])
+                elif res is None and addr in self.bauds:
+                    # slave enerji kesintisiyle varsayılan hıza dönmüş olabilir: iki kayıptan sonra yeniden tespit et
+                    self.misses[addr] = self.misses.get(addr, 0) + 1
+                    if self.misses[addr] >= 2:
+                        self.misses[addr] = 0
+                        self._store(addr, None)
+                results[addr] = res
+                TRACER.add("poll", slave_start, bus=bus, slave=addr)
+        finally:
+            self.ser.release()
+        self._flush()
+        self.sweeps += 1
+        METRICS.observe("mbus_sweep_seconds", time.perf_counter() - sweep_start, bus=bus)
+        TRACER.add("sweep", sweep_start, bus=bus)
+        return results
+
+# ---- KOLON DEPOSU ----
+class ColumnarStore:
+    # Slave başına tek dosya: zamana göre sıralı, sabit genişlikli (epoch, değer) float64 kayıtları,
+    # yalnızca sona eklenir. Okumalar numpy.memmap üzerinden kopyasız dilimlerdir. Seyrek zaman
+    # indeksi her INDEX_STRIDE'ıncı epoch'tur; arama önce indekste, sonra tek bir blokta yapılır.
+    DTYPE = np.dtype([("t", "<f8"), ("v", "<f8")])
+    INDEX_STRIDE = 4096
+
+    def __init__(self, root=COLUMNAR_DIR):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+        self.maps = {}
+        self.lock = threading.RLock()
+
+    def path(self, sid):
+        return os.path.join(self.root, f"slave_{sid}.col")
+
+    def _map(self, sid):
+        path = self.path(sid)
+        n = os.path.getsize(path) // self.DTYPE.itemsize if os.path.exists(path) else 0
+        with self.lock:
+            cached = self.maps.get(sid)
+            if cached and cached[0] == n:
+                return cached[1], cached[2]
+            if n:
+                arr = np.memmap(path, dtype=self.DTYPE, mode="r", shape=(n,))
+                idx = np.ascontiguousarray(arr["t"][::self.INDEX_STRIDE])
+            else:
+                arr = np.empty(0, self.DTYPE)
+                idx = np.empty(0)
+            self.maps[sid] = (n, arr, idx)
+            return arr, idx
+
+    def _search(self, t, idx, x):
+        k = int(np.searchsorted(idx, x))
+        if k == 0:
+            return 0
+        lo = (k - 1) * self.INDEX_STRIDE
+        hi = min(k * self.INDEX_STRIDE, len(t))
+        return lo + int(np.searchsorted(t[lo:hi], x))
+
+    def read(self, sid, start, end):
+        arr, idx = self._map(sid)
+        t = arr["t"]
+        i = self._search(t, idx, start)
+        j = self._search(t, idx, end)
+        return t[i:j], arr["v"][i:j]
+
+    def last_epoch(self, sid):
+        arr, _ = self._map(sid)
+        return float(arr["t"][-1]) if len(arr) else None
+
+    def append(self, sid, epochs, values):
+        # Sıralamayı korumak için son kayıttan eski ya da ona eşit zamanlı kayıtlar atlanır
+        # (build_columnar_store da aynı kuralı uygular); bu, spool'dan tekrar aktarılan kayıtları
+        # da etkisiz kılar.
+        with self.lock:
+            last = self.last_epoch(sid)
+            rec = np.empty(len(epochs), self.DTYPE)
+            rec["t"] = epochs
+            rec["v"] = values
+            if last is not None:
+                rec = rec[rec["t"] > last]
+            if not len(rec):
+                return 0
+            path = self.path(sid)
+            if os.path.exists(path) and os.path.getsize(path) % self.DTYPE.itemsize:
+                # yarım kalmış son kaydı at
+                with open(path, "r+b") as f:
+                    f.truncate(os.path.getsize(path) // self.DTYPE.itemsize * self.DTYPE.itemsize)
+            with open(path, "ab") as f:
+                f.write(rec.tobytes())
+            return len(rec)
+
+    def append_records(self, records):
+        by_slave = {}
+        for seq, epoch, sid, value in records:
+            by_slave.setdefault(sid, []).append((epoch, value))
+        for sid, rows in by_slave.items():
+            rows.sort()
+            self.append(sid, [r[0] for r in rows], [r[1] for r in rows])
+
+    def close(self):
+        with self.lock:
+            self.maps.clear()
+
+COLUMNAR = ColumnarStore() if STORE_BACKEND == "columnar" else None
+
+def build_columnar_store(root=COLUMNAR_DIR, chunk=100000):
+    # readings tablosundan kolon deposunu baştan üretir (collector kapalıyken çalıştırın)
+    os.makedirs(root, exist_ok=True)
+    store = ColumnarStore(root)
+    conn = sqlite3.connect(DB_PATH)
+    cur = conn.cursor()
+    cur.execute("SELECT slave_id, timestamp, value FROM readings ORDER BY slave_id, timestamp")
+    counts = {}
+    f, sid_open, last = None, None, -np.inf
+    while True:
+        rows = cur.fetchmany(chunk)
+        if not rows:
+            break
+        for sid in sorted({r[0] for r in rows}):
+            part = [r for r in rows if r[0] == sid]
+            if sid != sid_open:
+                if f:
+                    f.close()
+                    os.replace(store.path(sid_open) + ".tmp", store.path(sid_open))
+                f, sid_open, last = open(store.path(sid) + ".tmp", "wb"), sid, -np.inf
+            rec = np.empty(len(part), store.DTYPE)
+            rec["t"] = [datetime.fromisoformat(ts).timestamp() for _, ts, _ in part]
+            rec["v"] = [value or 0.0 for _, _, value in part]
+            rec = rec[rec["t"] > np.maximum.accumulate(np.concatenate(([last], rec["t"][:-1])))]
+            if len(rec):
+                last = rec["t"][-1]
+            f.write(rec.tobytes())
+            counts[sid] = counts.get(sid, 0) + len(rec)
+    if f:
+        f.close()
+        os.replace(store.path(sid_open) + ".tmp", store.path(sid_open))
+    conn.close()
+    return counts
+
+def fetch_slave_series(sid, start=None, end=None, conn=None):
+    # [start, end) epoch aralığındaki (zaman, değer) dizileri (None: açık uç); kolon deposu açıksa
+    # kopyasız okunur. conn verilirse (ör. sorgu API'sinin salt-okunur bağlantısı) o kullanılır.
+    if COLUMNAR is not None:
+        return COLUMNAR.read(sid, -np.inf if start is None else start, np.inf if end is None else end)
+    own = conn is None
+    if own:
+        conn = sqlite3.connect(DB_PATH)
+    try:
+        cur = conn.execute("""
+            SELECT timestamp, value
+            FROM readings
+            WHERE slave_id = ? AND timestamp >= ? AND timestamp < ?
+            ORDER BY timestamp
+        """, (sid, "0000" if start is None else datetime.fromtimestamp(start).isoformat(),
+              "9999" if end is None else datetime.fromtimestamp(end).isoformat()))
+        rows = cur.fetchall()
+    finally:
+        if own:
+            conn.close()
+    t = np.fromiter((datetime.fromisoformat(ts).timestamp() for ts, _ in rows), float, len(rows))
+    v = np.fromiter((value or 0.0 for _, value in rows), float, len(rows))
+    return t, v
+
+def fetch_last_reading_time(sid):
+    if COLUMNAR is not None:
+        last = COLUMNAR.last_epoch(sid)
+        return datetime.fromtimestamp(last).isoformat() if last is not None else None
+    conn = sqlite3.connect(DB_PATH)
+    cur = conn.cursor()
+    cur.execute("SELECT MAX(timestamp) FROM readings WHERE slave_id = ?", (sid,))
+    last = cur.fetchone()[0]
+    conn.close()
+    return last
+
+def fetch_slave_ids():
+    conn = sqlite3.connect(DB_PATH)
+    cur = conn.cursor()
+    cur.execute("SELECT DISTINCT slave_id FROM readings ORDER BY slave_id")
+    rows = [r[0] for r in cur.fetchall()]
+    conn.close()
+    return rows
+
+def fetch_slave_daily(sid, start, end):
+    days = [start + timedelta(days=i) for i in range((end - start).days + 1)]
+    if COLUMNAR is None:
+        conn = sqlite3.connect(DB_PATH)
+        cur = conn.cursor()
+        cur.execute("""
+            SELECT date(timestamp), SUM(value)
+            FROM readings
+            WHERE slave_id = ? AND timestamp >= ? AND timestamp < ?
+            GROUP BY date(timestamp)
+        """, (sid, start.isoformat(), (end + timedelta(days=1)).isoformat()))
+        rows = dict(cur.fetchall())
+        conn.close()
+        return [(d.strftime("%Y-%m-%d"), rows.get(d.strftime("%Y-%m-%d")) or 0) for d in days]
+    # kolon deposunda günlük toplamlar kümülatif toplamın gün sınırlarındaki farkıdır
+    bounds = np.array([datetime.combine(d, datetime.min.time()).timestamp()
+                       for d in days + [end + timedelta(days=1)]])
+    t, v = fetch_slave_series(sid, bounds[0], bounds[-1])
+    cs = np.concatenate(([0.0], np.cumsum(v)))
+    pos = np.searchsorted(t, bounds)
+    sums = cs[pos[1:]] - cs[pos[:-1]]
+    return [(d.strftime("%Y-%m-%d"), float(x)) for d, x in zip(days, sums)]
+
+# ---- GRAFİK ----
+MAX_XTICKS = 31
+
+def lttb(ys, threshold):
+    # Largest-Triangle-Three-Buckets: şekli koruyarak seriyi threshold noktaya indirir, seçilen indeksleri döner.
+    n = len(ys)
+    if threshold >= n or threshold < 3:
+        return list(range(n))
+    every = (n - 2) / (threshold - 2)
+    idx = [0]
+    a = 0
+    for i in range(threshold - 2):
+        b_start = int(i * every) + 1
+        b_end = int((i + 1) * every) + 1
+        n_end = min(int((i + 2) * every) + 1, n)
+        cnt = n_end - b_end
+        avg_x = (b_end + n_end - 1) / 2
+        avg_y = sum(ys[b_end:n_end]) / cnt
+        ay = ys[a]
+        best, best_area = b_start, -1.0
+        for j in range(b_start, b_end):
+            area = abs((a - avg_x) * (ys[j] - ay) - (a - j) * (avg_y - ay))
+            if area > best_area:
+                best, best_area = j, area
+        idx.append(best)
+        a = best
+    idx.append(n - 1)
+    return idx
+
+class ChartView:
+    # Bar/çizgi artist'lerini tekrar kullanır: veri değişince set_height/set_data + blit,
+    # eksen/etiket değişince tek bir draw_idle, yerleşim değişince tight_layout.
+    def __init__(self, fig, ax, canvas, blit=True):
+        self.fig = fig
+        self.ax = ax
+        self.canvas = canvas
+        self.blit = blit and canvas.supports_blit
+        self.background = None
+        self.data = None
+        self.clear()
+        if self.blit:
+            canvas.mpl_connect("draw_event", self._on_draw)
+
+    def clear(self):
+        self.ax.clear()
+        self.bars = []
+        self.line = None
+        self.style = None
+        self.texts = None
+        self.ticks = None
+        self.layout_key = None
+        self.ytop = None
+
+    def _artists(self):
+        arts = [r for r in self.bars if r.get_visible()]
+        if self.line is not None:
+            arts.append(self.line)
+        return arts
+
+    def _on_draw(self, event):
+        self.background = self.canvas.copy_from_bbox(self.fig.bbox)
+        for art in self._artists():
+            self.fig.draw_artist(art)
+
+    def _blit(self):
+        if self.background is None:
+            self.canvas.draw_idle()
+            return
+        self.canvas.restore_region(self.background)
+        for art in self._artists():
+            self.fig.draw_artist(art)
+        self.canvas.blit(self.fig.bbox)
+
+    def show(self, x_labels, vals, title="", xlabel="", ylabel="", bars=True, line=False,
+             bar_color="#1976d2", line_style=None, rotation=0, legend=False):
+        self.data = dict(x_labels=list(x_labels), vals=list(vals), title=title, xlabel=xlabel, ylabel=ylabel,
+                         bars=bars, line=line, bar_color=bar_color, line_style=line_style,
+                         rotation=rotation, legend=legend)
+        n = len(vals)
+        xs = list(range(n))
+        ys = list(vals)
+        width_px = max(int(self.ax.bbox.width), 3)
+        if n > width_px:
+            keep = lttb(ys, width_px)
+            xs = keep
+            ys = [ys[i] for i in keep]
+            bars, line = False, True
+        line_style = line_style or dict(color=bar_color, linewidth=1.5)
+
+        axes_changed = False
+        style = (bars, line, legend, tuple(sorted(line_style.items())))
+        if style != self.style:
+            self.clear()
+            self.style = style
+            axes_changed = True
+
+        if bars:
+            have = len(self.bars)
+            if have < n:
+                new = self.ax.bar(range(have, n), vals[have:], color=bar_color,
+                                  label="Bar" if not have else "_nolegend_")
+                for rect in new:
+                    rect.set_animated(self.blit)
+                self.bars.extend(new)
+            for i, rect in enumerate(self.bars):
+                if i < n:
+                    rect.set_height(vals[i])
+                    rect.set_visible(True)
+                else:
+                    rect.set_visible(False)
+        if line:
+            if self.line is None:
+                self.line, = self.ax.plot(xs, ys, label="Trend", animated=self.blit, **line_style)
+                axes_changed = True
+            else:
+                self.line.set_data(xs, ys)
+        if legend and axes_changed:
+            self.ax.legend(fontsize=11)
+
+        ticks = (n, tuple(x_labels), rotation)
+        if ticks != self.ticks:
+            step = -(-n // MAX_XTICKS) if n else 1
+            self.ax.set_xlim(-0.6, max(n - 0.4, 0.4))
+            self.ax.set_xticks(range(0, n, step))
+            self.ax.set_xticklabels(list(x_labels)[::step], rotation=rotation,
+                                    ha="right" if rotation else "center",
+                                    fontsize=9 if rotation else None)
+            self.ticks = ticks
+            axes_changed = True
+
+        top = max(vals) if n else 0
+        top = top * 1.08 if top > 0 else 1
+        if self.ytop is None or top > self.ytop or top < self.ytop * 0.5:
+            self.ax.set_ylim(0, top)
+            self.ytop = top
+            axes_changed = True
+
+        texts = (title, xlabel, ylabel)
+        if texts != self.texts:
+            self.ax.set_title(title, fontsize=13)
+            self.ax.set_xlabel(xlabel)
+            self.ax.set_ylabel(ylabel)
+            self.texts = texts
+            axes_changed = True
+
+        label_len = max((len(str(l)) for l in x_labels), default=0)
+        layout_key = (style, bool(title), xlabel, ylabel, rotation, label_len, self.fig.get_size_inches().tobytes())
+        if layout_key != self.layout_key:
+            self.fig.tight_layout()
+            self.layout_key = layout_key
+
+        if axes_changed or not self.blit:
+            self.canvas.draw_idle()
+        else:
+            self._blit()
+
+# ---- PDF / GRAFİK (Tk'siz, Agg) ----
+def render_chart_png(figsize=(8, 3.5), **chart):
+    fig = Figure(figsize=figsize)
+    canvas = FigureCanvasAgg(fig)
+    ChartView(fig, fig.add_subplot(111), canvas, blit=False).show(**chart)
+    buf = io.BytesIO()
+    fig.savefig(buf, format="png", bbox_inches="tight")
+    buf.seek(0)
+    return buf
+
+def pdf_table_style():
+    from reportlab.platypus import TableStyle
+    from reportlab.lib import colors
+    return TableStyle([
+        ("BACKGROUND", (0, 0), (-1, 0), colors.HexColor("#1976d2")),
+        ("TEXTCOLOR", (0, 0), (-1, 0), colors.whitesmoke),
+        ("ALIGN", (0, 0), (-1, -1), "CENTER"),
+        ("FONTNAME", (0, 0), (-1, 0), "Helvetica-Bold"),
+        ("FONTSIZE", (0, 0), (-1, 0), 10),
+        ("BOTTOMPADDING", (0, 0), (-1, 0), 8),
+        ("BACKGROUND", (0, 1), (-1, -1), colors.whitesmoke),
+        ("GRID", (0, 0), (-1, -1), 0.5, colors.gray),
+    ])
+
+def recent_months(count=12):
+    # Toplu PDF dönem seçimi: içinde bulunulan ay ve geriye doğru önceki aylar ("YYYY-MM")
+    d = date.today().replace(day=1)
+    months = []
+    for _ in range(count):
+        months.append(d.strftime("%Y-%m"))
+        d = (d - timedelta(days=1)).replace(day=1)
+    return months
+
+def month_bounds(month):
+    # "YYYY-MM" -> (ayın ilk günü, son günü); içinde bulunulan ay bugünle sınırlanır
+    start = datetime.strptime(month, "%Y-%m").date()
+    end = start.replace(day=calendar.monthrange(start.year, start.month)[1])
+    return start, min(end, date.today())
+
+def build_slave_pdf(sid, out_dir, start, end):
+    # ProcessPoolExecutor işçisinde çalışır: Tk'ye dokunmaz, grafik bellekte üretilir.
+    from reportlab.lib.pagesizes import A4
+    from reportlab.platypus import SimpleDocTemplate, Table, Spacer, Image, Paragraph
+    from reportlab.lib.styles import getSampleStyleSheet
+
+    days = fetch_slave_daily(sid, start, end)
+    vals = [v for _, v in days]
+    toplam = sum(vals)
+    ort = toplam / len(vals) if vals else 0
+    vmax = max(vals) if vals else 0
+
+    fname = os.path.join(out_dir, f"slave_{sid}_{start.strftime('%Y-%m')}.pdf")
+    styles = getSampleStyleSheet()
+    story = [
+        Paragraph(f"<b>Slave {sid} – {start.strftime('%d.%m.%Y')} / {end.strftime('%d.%m.%Y')}</b>", styles["Title"]),
+        Spacer(1, 8),
+        Paragraph(f"Toplam: {toplam:.2f} m³ &nbsp;&nbsp; Ort: {ort:.2f} m³/gün &nbsp;&nbsp; En Yüksek: {vmax:.2f} m³",
+                  styles["Normal"]),
+        Spacer(1, 12),
+    ]
+    if toplam > 0:
+        png = render_chart_png(x_labels=[d[-2:] for d, _ in days], vals=vals, title=f"Slave {sid} Günlük Su Tüketimi",
+                               xlabel="Gün", ylabel="Tüketim (m³)")
+        story.append(Image(png, width=430, height=200))
+        story.append(Spacer(1, 12))
+    data = [("Gün", "Tüketim (m³)")] + [(d, f"{v:.2f}") for d, v in days]
+    tbl = Table(data, hAlign="LEFT")
+    tbl.setStyle(pdf_table_style())
+    story.append(tbl)
+    SimpleDocTemplate(fname, pagesize=A4).build(story)
+    return sid, fname
+
 def list_ports():
     return list(serial.tools.list_ports.comports())
 
+class VirtualTable(tk.Frame):
+    # Pivot matrisini bellekte tutar; yalnızca görünen satır/sütunları Treeview'a yazar,
+    # hücreleri de o anda biçimlendirir. İlk sütun (etiket) yatay kaydırmada sabit kalır.
+    def __init__(self, parent, height=10, max_cols=11):
+        super().__init__(parent, bg="white")
+        self.view_rows = height
+        self.view_cols = max_cols
+        self.tree = ttk.Treeview(self, show="headings", height=height, selectmode="browse")
+        self.vbar = ttk.Scrollbar(self, orient="vertical", command=self._yview)
+        self.hbar = ttk.Scrollbar(self, orient="horizontal", command=self._xview)
+        self.tree.grid(row=0, column=0)
+        self.vbar.grid(row=0, column=1, sticky="ns")
+        self.hbar.grid(row=1, column=0, sticky="ew")
+        for seq in ("<MouseWheel>", "<Button-4>", "<Button-5>"):
+            self.tree.bind(seq, self._on_wheel)
+        self.tree.bind("<Shift-MouseWheel>", self._on_shift_wheel)
+        self.tree.bind("<Up>", lambda e: self._key_scroll(-1))
+        self.tree.bind("<Down>", lambda e: self._key_scroll(1))
+        self.tree.bind("<Prior>", lambda e: self._scroll_rows(-self.view_rows))
+        self.tree.bind("<Next>", lambda e: self._scroll_rows(self.view_rows))
+        self.tree.bind("<<TreeviewSelect>>", self._on_select, add="+")
+        self.tag_configure = self.tree.tag_configure
+        self.columns = []
+        self.rows = []
+        self.row_tags = {}
+        self.top = 0
+        self.left = 0
+        self.selected = None  # seçili satırın veri indeksi; Treeview öğeleri kaydırmada yeniden kullanılır
+
+    @staticmethod
+    def format_cell(value):
+        if isinstance(value, (int, float)) and not isinstance(value, bool):
+            return f"{value:.2f}"
+        return value
+
+    def bind(self, sequence=None, func=None, add=None):
+        return self.tree.bind(sequence, func, add)
+
+    def set_data(self, columns, rows, widths=90, row_tags=None):
+        self.columns = list(columns)
+        self.rows = rows
+        self.row_tags = row_tags or {}
+        self.top = 0
+        self.left = 0
+        self.selected = None
+        slots = [f"c{i}" for i in range(min(self.view_cols, len(self.columns)))]
+        self.tree.delete(*self.tree.get_children())
+        self.tree["columns"] = slots
+        if isinstance(widths, int):
+            widths = [widths] * len(slots)
+        for slot, width in zip(slots, widths):
+            self.tree.column(slot, width=width, anchor="center")
+        if len(self.columns) > len(slots):
+            self.hbar.grid()
+        else:
+            self.hbar.grid_remove()
+        self._render()
+
+    def clear(self):
+        self.set_data([], [])
+
+    def _visible_cols(self):
+        n = len(self.tree["columns"])
+        if not n:
+            return []
+        return [0] + list(range(1 + self.left, 1 + self.left + n - 1))
+
+    def _render(self):
+        cols = self._visible_cols()
+        for slot, ci in enumerate(cols):
+            self.tree.heading(f"c{slot}", text=self.columns[ci])
+        window = range(self.top, min(self.top + self.view_rows, len(self.rows)))
+        items = list(self.tree.get_children())
+        while len(items) < len(window):
+            items.append(self.tree.insert("", "end"))
+        if len(items) > len(window):
+            self.tree.delete(*items[len(window):])
+            items = items[:len(window)]
+        fmt = self.format_cell
+        for iid, ri in zip(items, window):
+            row = self.rows[ri]
+            self.tree.item(iid, values=[fmt(row[ci]) for ci in cols], tags=self.row_tags.get(ri, ()))
+        if self.selected in window:
+            iid = items[self.selected - self.top]
+            if self.tree.selection() != (iid,):
+                self.tree.selection_set(iid)
+        elif self.tree.selection():
+            self.tree.selection_set(())
+        n = len(self.rows)
+        if n:
+            self.vbar.set(self.top / n, (self.top + len(window)) / n)
+        else:
+            self.vbar.set(0, 1)
+        data_cols = max(len(self.columns) - 1, 1)
+        self.hbar.set(self.left / data_cols, min((self.left + len(cols) - 1) / data_cols, 1))
+
+    def _set_view(self, top, left):
+        visible = max(len(self.tree["columns"]) - 1, 0)
+        top = max(0, min(top, len(self.rows) - self.view_rows))
+        left = max(0, min(left, len(self.columns) - 1 - visible))
+        if (top, left) != (self.top, self.left):
+            self.top, self.left = top, left
+            self._render()
+
+    def _scroll_rows(self, delta):
+        self._set_view(self.top + delta, self.left)
+        return "break"
+
+    def _scroll_cols(self, delta):
+        self._set_view(self.top, self.left + delta)
+
+    def _yview(self, *args):
+        if args[0] == "moveto":
+            self._set_view(int(float(args[1]) * len(self.rows)), self.left)
+        elif args[0] == "scroll":
+            step = self.view_rows if args[2] == "pages" else 1
+            self._scroll_rows(int(args[1]) * step)
+
+    def _xview(self, *args):
+        visible = max(len(self.tree["columns"]) - 1, 1)
+        if args[0] == "moveto":
+            self._set_view(self.top, int(float(args[1]) * (len(self.columns) - 1)))
+        elif args[0] == "scroll":
+            step = visible if args[2] == "pages" else 1
+            self._scroll_cols(int(args[1]) * step)
+
+    def _on_wheel(self, event):
+        if event.num == 4 or event.delta > 0:
+            return self._scroll_rows(-3)
+        return self._scroll_rows(3)
+
+    def _on_shift_wheel(self, event):
+        self._scroll_cols(-1 if event.delta > 0 else 1)
+        return "break"
+
+    def _on_select(self, event):
+        sel = self.tree.selection()
+        if sel:
+            self.selected = self.top + self.tree.index(sel[0])
+        elif self.selected is not None and self.top <= self.selected < self.top + self.view_rows:
+            # pencere dışına kaydırılan seçimi _render temizler; burada yalnızca kullanıcı temizlemesi
+            self.selected = None
+
+    def _key_scroll(self, delta):
+        sel = self.tree.selection()
+        items = self.tree.get_children()
+        if not sel or not items:
+            return None
+        edge = items[0] if delta < 0 else items[-1]
+        if sel[0] != edge:
+            return None
+        if 0 <= self.selected + delta < len(self.rows):
+            self.selected += delta
+        self._scroll_rows(delta)
+        return "break"
+
+    def selected_row(self):
+        if self.selected is None or self.selected >= len(self.rows):
+            return None
+        return self.rows[self.selected]
+
+    def export_rows(self):
+        fmt = self.format_cell
+        return [self.columns] + [[fmt(v) for v in row] for row in self.rows]
+
 class MBusGUI:
     def __init__(self, root):
         self.root = root
@@ -174,6 +1989,8 @@ class MBusGUI:
         self.build_gui()
         self.update_ports()
         init_db()
+        self.spool = ReadingSpool(SPOOL_PATH, start_seq=load_spool_seq() + 1)
+        self.drainer = SpoolDrainer(self.spool).start()
         self.show_welcome()
 
     def build_gui(self):
@@ -188,9 +2005,19 @@ class MBusGUI:
         self.btn_report = tk.Button(menu_frame, text="Raporlar", font=("Segoe UI", 12, "bold"), command=self.show_report)
         self.btn_report.pack(fill="x", pady=10, padx=14)
         tk.Label(menu_frame, text="Port Seç:", bg="#ececec", font=("Segoe UI", 11)).pack(pady=(44,6))
-        self.port_combo = ttk.Combobox(menu_frame, textvariable=self.selected_port, state="readonly", font=("Segoe UI", 10))
+        self.port_combo = ttk.Combobox(menu_frame, textvariable=self.selected_port, font=("Segoe UI", 10))
         self.port_combo.pack(fill="x", padx=14)
         self.port_combo.bind("<<ComboboxSelected>>", self.on_port_selected)
+        self.port_combo.bind("<Return>", self.on_port_selected)
+        tk.Label(menu_frame, text="Tanılama:", bg="#ececec", font=("Segoe UI", 11)).pack(pady=(30,6))
+        self.trace_btn = tk.Button(menu_frame, text="Trace Başlat", font=("Segoe UI", 10), command=self.toggle_trace)
+        self.trace_btn.pack(fill="x", padx=14, pady=(0,6))
+        self.profile_mode = ttk.Combobox(menu_frame, values=["Örnekleme", "cProfile"], state="readonly", font=("Segoe UI", 10))
+        self.profile_mode.current(0)
+        self.profile_mode.pack(fill="x", padx=14, pady=(0,6))
+        self.profile_btn = tk.Button(menu_frame, text=f"Profil Al ({PROFILE_SECONDS} sn)", font=("Segoe UI", 10),
+                                     command=self.capture_profile)
+        self.profile_btn.pack(fill="x", padx=14)
         self.btn_exit = tk.Button(menu_frame, text="Çıkış", bg="#f44336", fg="white", font=("Segoe UI", 12, "bold"), command=self.root.quit)
         self.btn_exit.pack(side="bottom", fill="x", pady=26, padx=14)
         self.main_frame = tk.Frame(self.root, bg="white")
@@ -253,28 +2080,31 @@ class MBusGUI:
         self.period_combo.bind("<<ComboboxSelected>>", lambda e: self.refresh_report())
         self.pdf_btn = tk.Button(top, text="PDF Olarak Kaydet", font=("Segoe UI", 10), command=self.export_pdf)
         self.pdf_btn.pack(side="left", padx=(12, 8))
+        self.pdf_batch_btn = tk.Button(top, text="Toplu PDF", font=("Segoe UI", 10), command=self.export_pdf_batch)
+        self.pdf_batch_btn.pack(side="left", padx=(0, 4))
+        self.batch_month_combo = ttk.Combobox(top, values=recent_months(), state="readonly", width=8,
+                                              font=("Segoe UI", 11))
+        self.batch_month_combo.current(1)  # varsayılan: kapanmış önceki ay
+        self.batch_month_combo.pack(side="left", padx=(0, 8))
         self.threshold_var = tk.IntVar(value=300)
         self.threshold_label = tk.Label(top, text="Eşik (m³):", font=("Segoe UI", 11), bg="white")
         self.threshold_entry = tk.Entry(top, width=7, textvariable=self.threshold_var, font=("Segoe UI", 11))
         self.threshold_btn = tk.Button(top, text="Güncelle", font=("Segoe UI", 10), command=self.refresh_report)
-        self.report_table = ttk.Treeview(frame)
+        self.report_table = VirtualTable(frame)
+        self.report_table.tag_configure('pik', background="#ffe082")
         self.report_table.pack(padx=22, pady=(10,10))
         self.fig = Figure(figsize=(8, 3.5))
         self.ax = self.fig.add_subplot(111)
         self.canvas = FigureCanvasTkAgg(self.fig, master=frame)
         self.graph_widget = self.canvas.get_tk_widget()
+        self.chart = ChartView(self.fig, self.ax, self.canvas)
         self.report_table.bind("<Double-1>", self.show_slave_history)
         return frame
 
     def export_pdf(self):
         from reportlab.lib.pagesizes import A4
-        from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Spacer, Image, Paragraph
-        from reportlab.lib import colors
+        from reportlab.platypus import SimpleDocTemplate, Table, Spacer, Image, Paragraph
         from reportlab.lib.styles import getSampleStyleSheet
-        import tempfile
-        import os
-        from datetime import datetime
-        import time
         from tkinter import filedialog
 
         defaultname = f"rapor_{datetime.now().strftime('%Y-%m-%d_%H-%M-%S')}.pdf"
@@ -289,62 +2119,92 @@ class MBusGUI:
 
         doc = SimpleDocTemplate(fname, pagesize=A4)
 
-        columns = self.report_table["columns"]
-        data = [columns]
-        for item in self.report_table.get_children():
-            data.append(list(self.report_table.item(item)["values"]))
+        data = self.report_table.export_rows()
 
         tbl = Table(data, hAlign="LEFT")
-        tbl.setStyle(TableStyle([
-            ("BACKGROUND", (0, 0), (-1, 0), colors.HexColor("#1976d2")),
-            ("TEXTCOLOR", (0, 0), (-1, 0), colors.whitesmoke),
-            ("ALIGN", (0, 0), (-1, -1), "CENTER"),
-            ("FONTNAME", (0, 0), (-1, 0), "Helvetica-Bold"),
-            ("FONTSIZE", (0, 0), (-1, 0), 10),
-            ("BOTTOMPADDING", (0, 0), (-1, 0), 8),
-            ("BACKGROUND", (0, 1), (-1, -1), colors.whitesmoke),
-            ("GRID", (0, 0), (-1, -1), 0.5, colors.gray),
-        ]))
+        tbl.setStyle(pdf_table_style())
 
         story = []
         story.append(Paragraph(f"<b>Rapor: {self.period_combo.get()}</b>", getSampleStyleSheet()["Title"]))
         story.append(Spacer(1, 16))
         story.append(tbl)
         story.append(Spacer(1, 16))
-        has_graph = False
-        tmpimg_name = None
-        if hasattr(self, 'ax') and len(self.ax.patches) > 0:
-            tmpimg = tempfile.NamedTemporaryFile(suffix=".png", delete=False)
-            self.fig.savefig(tmpimg.name, bbox_inches='tight')
-            tmpimg.close()
-            tmpimg_name = tmpimg.name
-            story.append(Image(tmpimg_name, width=430, height=200))
-            has_graph = True
+        if self.chart.data and self.chart.data["bars"]:
+            story.append(Image(render_chart_png(**self.chart.data), width=430, height=200))
 
         doc.build(story)
 
-        if has_graph and tmpimg_name:
-            for _ in range(10):
-                try:
-                    os.remove(tmpimg_name)
-                    break
-                except PermissionError:
-                    time.sleep(0.2)
-
         messagebox.showinfo("PDF Kaydedildi", f"Rapor PDF olarak kaydedildi:\n{fname}")
 
+    def export_pdf_batch(self):
+        from tkinter import filedialog
+
+        if getattr(self, "batch_thread", None) and self.batch_thread.is_alive():
+            return
+        out_dir = filedialog.askdirectory(title="Toplu PDF Klasörü Seç")
+        if not out_dir:
+            return
+        slaves = fetch_slave_ids()
+        if not slaves:
+            messagebox.showinfo("Toplu PDF", "Veritabanında slave kaydı yok.")
+            return
+        start, end = month_bounds(self.batch_month_combo.get())
+
+        win = tk.Toplevel(self.root)
+        win.title("Toplu PDF")
+        win.configure(bg="white")
+        win.resizable(False, False)
+        lbl = tk.Label(win, text="Hazırlanıyor...", font=("Segoe UI", 11), bg="white")
+        lbl.pack(padx=22, pady=(16, 6))
+        bar = ttk.Progressbar(win, length=360, maximum=len(slaves))
+        bar.pack(padx=22, pady=(0, 16))
+        win.transient(self.root)
+
+        self.batch_state = {"done": 0, "errors": [], "finished": False}
+        state = self.batch_state
+
+        def worker():
+            try:
+                # fork yerine spawn: Tk süreci sorgu/aktarım/HTTP iş parçacıkları kilit tutarken çatallanmasın
+                with ProcessPoolExecutor(mp_context=multiprocessing.get_context("spawn")) as pool:
+                    futures = {pool.submit(build_slave_pdf, sid, out_dir, start, end): sid for sid in slaves}
+                    for fut in as_completed(futures):
+                        try:
+                            fut.result()
+                        except Exception as ex:
+                            state["errors"].append(f"Slave {futures[fut]}: {ex}")
+                        state["done"] += 1
+            except Exception as ex:
+                state["errors"].append(f"İşlem havuzu: {ex}")
+            finally:
+                state["finished"] = True
+
+        def poll_progress():
+            bar["value"] = state["done"]
+            lbl.config(text=f"{state['done']} / {len(slaves)} PDF hazırlandı")
+            if not state["finished"]:
+                self.root.after(100, poll_progress)
+                return
+            win.destroy()
+            if state["errors"]:
+                messagebox.showerror("Toplu PDF", "Bazı PDF'ler oluşturulamadı:\n" + "\n".join(state["errors"][:10]))
+            else:
+                messagebox.showinfo("Toplu PDF", f"{len(slaves)} PDF kaydedildi:\n{out_dir}")
+
+        self.batch_thread = threading.Thread(target=worker, daemon=True)
+        self.batch_thread.start()
+        poll_progress()
+
     def show_slave_history(self, event):
         import tkinter as tk
         from tkinter import ttk
         from matplotlib.figure import Figure
         from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
-        import sqlite3
         from datetime import date, timedelta
 
-        item = self.report_table.selection()
-        if not item:
+        values = self.report_table.selected_row()
+        if not values:
             return
-        values = self.report_table.item(item[0])["values"]
         slave_str = str(values[0])
         if "Slave" in slave_str:
             sid = int(slave_str.split()[1])
@@ -392,6 +2252,7 @@ class MBusGUI:
         ax = fig.add_subplot(111)
         canvas_mpl = FigureCanvasTkAgg(fig, master=graph_frame)
         canvas_mpl.get_tk_widget().pack(fill="x", expand=True)
+        chart = ChartView(fig, ax, canvas_mpl)
 
         # ---- TABLO (Günlük tüketim) ----
         table_frame = tk.Frame(scroll_frame, bg="white")
@@ -429,24 +2290,12 @@ class MBusGUI:
                   fg="white", padx=16, pady=3, relief="ridge").pack(pady=18)
 
         # ---- GÜNCELLEME FONKSİYONU ----
+        @traced("slave_history")
         def update_panel(days_count):
-            conn = sqlite3.connect(DB_PATH)
-            cur = conn.cursor()
             today = date.today()
-            tarih_liste = [(today - timedelta(days=i)) for i in range(days_count - 1, -1, -1)]
-            tarih_str_liste = [d.strftime("%Y-%m-%d") for d in tarih_liste]
-            days_ = []
-            vals_ = []
-            for d in tarih_str_liste:
-                cur.execute("""
-                            SELECT SUM(value)
-                            FROM readings
-                            WHERE slave_id = ? AND date (timestamp)=?
-                            """, (sid, d))
-                res = cur.fetchone()
-                val = res[0] if res[0] is not None else 0
-                days_.append(d[-5:])  # ay-gün
-                vals_.append(val)
+            gunluk = fetch_slave_daily(sid, today - timedelta(days=days_count - 1), today)
+            days_ = [d[-5:] for d, _ in gunluk]  # ay-gün
+            vals_ = [v for _, v in gunluk]
             toplam = sum(vals_)
             ort = toplam / len(vals_) if vals_ else 0
             vmax = max(vals_) if vals_ else 0
@@ -456,13 +2305,7 @@ class MBusGUI:
                 pik_gun = days_[pik_idx]
             except:
                 pik_gun = "-"
-            cur.execute("""
-                        SELECT MAX(timestamp)
-                        FROM readings
-                        WHERE slave_id = ?
-                        """, (sid,))
-            last_read = cur.fetchone()[0]
-            conn.close()
+            last_read = fetch_last_reading_time(sid)
 
             table.delete(*table.get_children())
             for g, v in zip(days_, vals_):
@@ -479,17 +2322,9 @@ class MBusGUI:
             for i, stat in enumerate(stats):
                 stats_labels[i].config(text=stat)
 
-            ax.clear()
-            ax.bar(range(len(days_)), vals_, color="#2196f3", label="Bar")
-            ax.plot(range(len(days_)), vals_, color="#e53935", marker="o", linewidth=2, label="Trend")
-            ax.set_title(f"Slave {sid} – Son {days_count} Günlük Su Tüketimi", fontsize=13)
-            ax.set_xlabel("Gün")
-            ax.set_ylabel("Tüketim (m³)")
-            ax.legend(fontsize=11)
-            ax.set_xticks(range(len(days_)))
-            ax.set_xticklabels(days_, rotation=45, ha='right', fontsize=9)
-            fig.tight_layout()
-            canvas_mpl.draw()
+            chart.show(days_, vals_, title=f"Slave {sid} – Son {days_count} Günlük Su Tüketimi",
+                       xlabel="Gün", ylabel="Tüketim (m³)", bars=True, line=True, bar_color="#2196f3",
+                       line_style=dict(color="#e53935", marker="o", linewidth=2), rotation=45, legend=True)
 
         update_panel(slider.get())
         slider.config(command=lambda val: update_panel(int(val)))
@@ -503,6 +2338,61 @@ class MBusGUI:
         win.grab_set()
         win.focus_set()
 
+    def toggle_trace(self):
+        from tkinter import filedialog
+
+        if not TRACER.enabled:
+            TRACER.start()
+            self.trace_btn.config(text="Trace Durdur")
+            return
+        TRACER.stop()
+        self.trace_btn.config(text="Trace Başlat")
+        fname = filedialog.asksaveasfilename(
+            title="Trace Kaydet",
+            defaultextension=".json",
+            initialfile=f"trace_{datetime.now().strftime('%Y-%m-%d_%H-%M-%S')}.json",
+            filetypes=[("Chrome Trace", "*.json")]
+        )
+        if fname:
+            TRACER.dump(fname)
+
+    def capture_profile(self):
+        from tkinter import filedialog
+
+        mode = "cprofile" if self.profile_mode.get() == "cProfile" else "sample"
+        fname = filedialog.asksaveasfilename(
+            title="Profil Kaydet",
+            defaultextension=".txt",
+            initialfile=f"profil_{mode}_{datetime.now().strftime('%Y-%m-%d_%H-%M-%S')}.txt",
+            filetypes=[("Metin", "*.txt")]
+        )
+        if not fname:
+            return
+        self.profile_btn.config(state="disabled", text="Profil alınıyor...")
+        state = {"error": None, "finished": False}
+
+        def worker():
+            try:
+                text = PROFILER.run(PROFILE_SECONDS, mode)
+                with open(fname, "w", encoding="utf-8") as f:
+                    f.write(text)
+            except Exception as ex:
+                state["error"] = str(ex)
+            state["finished"] = True
+
+        def poll_done():
+            if not state["finished"]:
+                self.root.after(200, poll_done)
+                return
+            self.profile_btn.config(state="normal", text=f"Profil Al ({PROFILE_SECONDS} sn)")
+            if state["error"]:
+                messagebox.showerror("Profil", state["error"])
+            else:
+                messagebox.showinfo("Profil", f"Profil kaydedildi:\n{fname}")
+
+        threading.Thread(target=worker, daemon=True).start()
+        poll_done()
+
     def show_welcome(self):
         self.stop_polling()
         self.panel_live.pack_forget()
@@ -524,7 +2414,7 @@ class MBusGUI:
 
     def update_ports(self):
         ports = list_ports()
-        port_list = [p.device for p in ports]
+        port_list = [p.device for p in ports] + TCP_GATEWAYS
         self.port_combo["values"] = port_list
         if port_list:
             self.selected_port.set(port_list[0])
@@ -540,14 +2430,13 @@ class MBusGUI:
                 self.ser.close()
             except:
                 pass
-        port = self.selected_port.get()
+        port = self.selected_port.get().strip()
         if not port:
             return
         try:
-            self.ser = serial.Serial(port, BAUDRATE, timeout=0.5)
-            time.sleep(2)
+            self.ser = open_transport(port)
         except Exception as e:
-            messagebox.showerror("Hata", f"Seri port açılamadı: {e}")
+            messagebox.showerror("Hata", f"Port açılamadı: {e}")
             self.ser = None
 
     def start_polling(self):
@@ -563,40 +2452,54 @@ class MBusGUI:
         self.running = False
 
     def poll_loop(self):
+        try:
+            self._poll_loop()
+        except BaseException:
+            # iş parçacığı beklenmedik şekilde biterse start_polling yeniden başlatabilsin
+            self.running = False
+            raise
+        finally:
+            PROFILER.tick(final=True)
+
+    def _poll_loop(self):
+        poller = None
         while self.running and self.ser:
+            if poller is None or poller.ser is not self.ser:
+                poller = BusPoller(self.ser, range(1, NUM_SLAVES+1))
             updated = False
-            for addr in range(1, NUM_SLAVES+1):
-                try:
-                    self.ser.reset_input_buffer()
-                    req = build_request(addr)
-                    self.ser.write(req)
-                    time.sleep(0.5)
-                    frame = read_frame(self.ser)
-                    if frame:
-                        print("GELEN FRAME:", frame.hex())
-                        res = parse_long_frame(frame)
-                        if res:
-                            a, v, slaveid = res
-                            self.slave_data[a] = f"{v:.2f}"
-                            self.slave_ids[a] = slaveid
-                            insert_reading(a, v)
-                            updated = True
-                        else:
-                            self.slave_data[addr] = "ERR"
-                            self.slave_ids[addr] = "----"
-                    else:
-                        self.slave_data[addr] = "---"
-                        self.slave_ids[addr] = "----"
-                except Exception as ex:
+            try:
+                results = poller.sweep()
+            except Exception as ex:
+                METRICS.inc("mbus_poll_errors_total", bus=poller.bus)
+                print(f"Sorgu turu hatası ({poller.bus}): {ex}")
+                results = {}
+            for addr, res in results.items():
+                if res:
+                    a, v, slaveid, epoch = res
+                    self.slave_data[a] = f"{v:.2f}"
+                    self.slave_ids[a] = slaveid
+                    try:
+                        METRICS.set("mbus_ingest_queue_depth", self.spool.append(a, v, epoch))
+                        self.drainer.wake.set()
+                        updated = True
+                    except Exception as ex:
+                        METRICS.inc("mbus_poll_errors_total", bus=poller.bus, slave=a)
+                        self.slave_data[a] = "ERR"
+                        self.slave_ids[a] = "----"
+                        print(f"Slave {a} hata: {ex}")
+                elif res is False:
                     self.slave_data[addr] = "ERR"
                     self.slave_ids[addr] = "----"
-                    print(f"Slave {addr} hata: {ex}")
+                else:
+                    self.slave_data[addr] = "---"
+                    self.slave_ids[addr] = "----"
             if updated:
                 self.last_read_time = datetime.now()
             self.update_live_table()
             for _ in range(POLL_INTERVAL * 2):
                 if not self.running:
                     break
+                PROFILER.tick()
                 time.sleep(0.5)
 
     def update_live_table(self):
@@ -615,18 +2518,22 @@ class MBusGUI:
         self.slave_table.tag_configure('err', background="#ffeaea")
 
     def reset_table(self):
-        for col in self.report_table["columns"]:
-            self.report_table.heading(col, text="")
-            self.report_table.column(col, width=0)
-        self.report_table["columns"] = []
-        self.report_table["show"] = "headings"
-        for i in self.report_table.get_children():
-            self.report_table.delete(i)
+        self.report_table.clear()
         self.report_table.pack(padx=22, pady=(10,10))
 
+    def pivot_rows(self, keys, labels, slave_data):
+        rows, total_vals = [], []
+        for key, label in zip(keys, labels):
+            vals = slave_data[key]
+            toplam = sum(vals)
+            rows.append([label] + vals + [toplam])
+            total_vals.append(toplam)
+        return rows, total_vals
+
+    @traced("refresh_report")
     def refresh_report(self):
         self.graph_widget.pack_forget()
-        self.ax.clear()
+        self.chart.data = None
         for widget in self.summary_frame.winfo_children():
             widget.destroy()
         period = self.period_combo.get() or "Günlük"
@@ -646,32 +2553,22 @@ class MBusGUI:
             if rows:
                 days = [row[0][-5:] for row in rows]
                 vals = [row[1] for row in rows]
-                self.ax.plot(days, vals, marker="o", linewidth=2, color="#1565c0")
-                self.ax.set_title("Son 7 Gün Tüketim Trend Grafiği", fontsize=13, weight="bold")
-                self.ax.set_xlabel("Tarih")
-                self.ax.set_ylabel("Toplam m³")
-                self.fig.tight_layout()
-                self.canvas.draw()
+                self.chart.show(days, vals, title="Son 7 Gün Tüketim Trend Grafiği", xlabel="Tarih",
+                                ylabel="Toplam m³", bars=False, line=True,
+                                line_style=dict(color="#1565c0", marker="o", linewidth=2))
                 self.graph_widget.pack(padx=22, pady=10)
             return
         else:
             self.reset_table()
 
         slave_cols = [f"Slave {sid}" for sid in range(1, NUM_SLAVES+1)]
-        columns = []
         x_labels, total_vals = [], []
-        slave_vals = {sid: [] for sid in range(1, NUM_SLAVES+1)}
 
         if period == "Günlük":
             saatler = [str(i).zfill(2) for i in range(24)]
-            columns = ["Saat"] + slave_cols + ["Toplam"]
-            self.report_table["columns"] = columns
-            for col in columns:
-                self.report_table.heading(col, text=col)
-                self.report_table.column(col, width=90, anchor="center")
             conn = sqlite3.connect(DB_PATH)
             cur = conn.cursor()
-            slave_data = {s: {sl: 0 for sl in range(1, NUM_SLAVES+1)} for s in saatler}
+            slave_data = {s: [0] * NUM_SLAVES for s in saatler}
             cur.execute("""
                 SELECT strftime('%H', timestamp) as saat, slave_id, SUM(value)
                 FROM readings
@@ -679,32 +2576,19 @@ class MBusGUI:
                 GROUP BY saat, slave_id
             """)
             for saat, sid, toplam in cur.fetchall():
-                slave_data[saat][sid] = toplam
+                if 1 <= sid <= NUM_SLAVES:
+                    slave_data[saat][sid-1] = toplam
             conn.close()
-            for saat in saatler:
-                row = [f"{saat}:00"]
-                toplam = 0
-                for sid in range(1, NUM_SLAVES+1):
-                    val = slave_data[saat][sid]
-                    row.append(f"{val:.2f}")
-                    toplam += val
-                    slave_vals[sid].append(val)
-                row.append(f"{toplam:.2f}")
-                self.report_table.insert("", "end", values=row)
-                total_vals.append(toplam)
-                x_labels.append(saat)
+            rows, total_vals = self.pivot_rows(saatler, [f"{saat}:00" for saat in saatler], slave_data)
+            self.report_table.set_data(["Saat"] + slave_cols + ["Toplam"], rows)
+            x_labels = saatler
         elif period == "Haftalık":
             gun_ad = ['Pzt', 'Sal', 'Çar', 'Per', 'Cum', 'Cmt', 'Paz']
             today = date.today()
             tarih_liste = [(today - timedelta(days=(today.weekday()-i)%7)).strftime("%Y-%m-%d") for i in range(7)]
-            columns = ["Gün"] + slave_cols + ["Toplam"]
-            self.report_table["columns"] = columns
-            for col in columns:
-                self.report_table.heading(col, text=col)
-                self.report_table.column(col, width=90, anchor="center")
             conn = sqlite3.connect(DB_PATH)
             cur = conn.cursor()
-            slave_data = {t: {sl: 0 for sl in range(1, NUM_SLAVES+1)} for t in tarih_liste}
+            slave_data = {t: [0] * NUM_SLAVES for t in tarih_liste}
             cur.execute("""
                 SELECT date(timestamp), slave_id, SUM(value)
                 FROM readings
@@ -712,23 +2596,15 @@ class MBusGUI:
                 GROUP BY date(timestamp), slave_id
             """)
             for t, sid, toplam in cur.fetchall():
-                slave_data[t][sid] = toplam
+                if t in slave_data and 1 <= sid <= NUM_SLAVES:
+                    slave_data[t][sid-1] = toplam
             conn.close()
-            for d in tarih_liste:
-                gunidx = datetime.strptime(d, "%Y-%m-%d").weekday()
-                row = [f"{gun_ad[gunidx]} ({d[-5:]})"]
-                toplam = 0
-                for sid in range(1, NUM_SLAVES+1):
-                    val = slave_data[d][sid]
-                    row.append(f"{val:.2f}")
-                    toplam += val
-                    slave_vals[sid].append(val)
-                row.append(f"{toplam:.2f}")
-                self.report_table.insert("", "end", values=row)
-                total_vals.append(toplam)
-                x_labels.append(gun_ad[gunidx])
+            gunler = [gun_ad[datetime.strptime(d, "%Y-%m-%d").weekday()] for d in tarih_liste]
+            rows, total_vals = self.pivot_rows(
+                tarih_liste, [f"{g} ({d[-5:]})" for g, d in zip(gunler, tarih_liste)], slave_data)
+            self.report_table.set_data(["Gün"] + slave_cols + ["Toplam"], rows)
+            x_labels = gunler
         elif period == "Aylık":
-            self.reset_table()
             today = date.today()
             first_day = today.replace(day=1)
             gunler = []
@@ -738,14 +2614,9 @@ class MBusGUI:
                 gunler.append(d.strftime("%d"))
                 tarih_str_liste.append(d.strftime("%Y-%m-%d"))
                 d += timedelta(days=1)
-            columns = ["Gün"] + slave_cols + ["Toplam"]
-            self.report_table["columns"] = columns
-            for col in columns:
-                self.report_table.heading(col, text=col)
-                self.report_table.column(col, width=90, anchor="center")
             conn = sqlite3.connect(DB_PATH)
             cur = conn.cursor()
-            slave_data = {d: {sl: 0 for sl in range(1, NUM_SLAVES+1)} for d in tarih_str_liste}
+            slave_data = {d: [0] * NUM_SLAVES for d in tarih_str_liste}
             cur.execute("""
                 SELECT date(timestamp), slave_id, SUM(value)
                 FROM readings
@@ -753,42 +2624,24 @@ class MBusGUI:
                 GROUP BY date(timestamp), slave_id
             """, (tarih_str_liste[0],))
             for t, sid, toplam in cur.fetchall():
-                if t in slave_data:
-                    slave_data[t][sid] = toplam
+                if t in slave_data and 1 <= sid <= NUM_SLAVES:
+                    slave_data[t][sid-1] = toplam
             conn.close()
-            for g, d in zip(gunler, tarih_str_liste):
-                row = [f"{g} ({d[-5:]})"]
-                toplam = 0
-                for sid in range(1, NUM_SLAVES+1):
-                    val = slave_data[d][sid]
-                    row.append(f"{val:.2f}")
-                    toplam += val
-                    slave_vals[sid].append(val)
-                row.append(f"{toplam:.2f}")
-                self.report_table.insert("", "end", values=row)
-                x_labels.append(g)
-                total_vals.append(toplam)
-            self.ax.clear()
+            rows, total_vals = self.pivot_rows(
+                tarih_str_liste, [f"{g} ({d[-5:]})" for g, d in zip(gunler, tarih_str_liste)], slave_data)
+            self.report_table.set_data(["Gün"] + slave_cols + ["Toplam"], rows)
+            x_labels = gunler
             if x_labels and total_vals:
-                self.ax.bar(x_labels, total_vals, color="#1976d2")
-                self.ax.set_title("Aylık Toplam Su Tüketimi")
-                self.ax.set_xlabel("Gün")
-                self.ax.set_ylabel("Tüketim (m³)")
-                self.fig.tight_layout()
-                self.canvas.draw()
+                self.chart.show(x_labels, total_vals, title="Aylık Toplam Su Tüketimi",
+                                xlabel="Gün", ylabel="Tüketim (m³)")
                 self.graph_widget.pack(padx=22, pady=10)
         elif period == "Yıllık":
             thisyear = date.today().year
             aylar = [calendar.month_abbr[m] for m in range(1,13)]
             yilsira = [f"{thisyear}-{str(m).zfill(2)}" for m in range(1,13)]
-            columns = ["Ay"] + slave_cols + ["Toplam"]
-            self.report_table["columns"] = columns
-            for col in columns:
-                self.report_table.heading(col, text=col)
-                self.report_table.column(col, width=90, anchor="center")
             conn = sqlite3.connect(DB_PATH)
             cur = conn.cursor()
-            slave_data = {y: {sl: 0 for sl in range(1, NUM_SLAVES+1)} for y in yilsira}
+            slave_data = {y: [0] * NUM_SLAVES for y in yilsira}
             cur.execute("""
                 SELECT strftime('%Y-%m', timestamp), slave_id, SUM(value)
                 FROM readings
@@ -796,29 +2649,16 @@ class MBusGUI:
                 GROUP BY strftime('%Y-%m', timestamp), slave_id
             """)
             for yyyymm, sid, toplam in cur.fetchall():
-                if yyyymm in slave_data:
-                    slave_data[yyyymm][sid] = toplam
+                if yyyymm in slave_data and 1 <= sid <= NUM_SLAVES:
+                    slave_data[yyyymm][sid-1] = toplam
             conn.close()
-            for ay, y in zip(aylar, yilsira):
-                row = [ay]
-                toplam = 0
-                for sid in range(1, NUM_SLAVES+1):
-                    val = slave_data[y][sid]
-                    row.append(f"{val:.2f}")
-                    toplam += val
-                    slave_vals[sid].append(val)
-                row.append(f"{toplam:.2f}")
-                self.report_table.insert("", "end", values=row)
-                total_vals.append(toplam)
-                x_labels.append(ay)
+            rows, total_vals = self.pivot_rows(yilsira, aylar, slave_data)
+            self.report_table.set_data(["Ay"] + slave_cols + ["Toplam"], rows)
+            x_labels = aylar
         elif period == "Ortalama Tüketim":
-            self.report_table["columns"] = ["Slave", "Anlık Tüketim (m³)"]
-            self.report_table.heading("Slave", text="Slave")
-            self.report_table.heading("Anlık Tüketim (m³)", text="Anlık Tüketim (m³)")
-            self.report_table.column("Slave", width=160, anchor="center")
-            self.report_table.column("Anlık Tüketim (m³)", width=160, anchor="center")
             conn = sqlite3.connect(DB_PATH)
             cur = conn.cursor()
+            rows = []
             for sid in range(1, NUM_SLAVES + 1):
                 cur.execute("""
                     SELECT value FROM readings
@@ -833,56 +2673,115 @@ class MBusGUI:
                         anlik = 0
                 else:
                     anlik = 0
-                self.report_table.insert("", "end", values=(f"Slave {sid}", f"{anlik:.2f}"))
+                rows.append([f"Slave {sid}", anlik])
             conn.close()
+            self.report_table.set_data(["Slave", "Anlık Tüketim (m³)"], rows, widths=160)
         elif period == "Daire Karşılaştırma":
-            self.report_table["columns"] = ["Slave", "Aylık Toplam (m³)"]
-            self.report_table.heading("Slave", text="Slave")
-            self.report_table.heading("Aylık Toplam (m³)", text="Aylık Toplam (m³)")
-            self.report_table.column("Slave", width=160, anchor="center")
-            self.report_table.column("Aylık Toplam (m³)", width=160, anchor="center")
             data = fetch_all_for_compare("Aylık")
-            if data:
-                for sid, total in sorted(data, key=lambda x: -x[1]):
-                    self.report_table.insert("", "end", values=(f"Slave {sid}", f"{total:.2f}"))
+            rows = [[f"Slave {sid}", total] for sid, total in sorted(data or [], key=lambda x: -x[1])]
+            self.report_table.set_data(["Slave", "Aylık Toplam (m³)"], rows, widths=160)
         elif period == "Pik Kullanım":
-            self.report_table["columns"] = ["Slave", "En Yüksek Anlık (m³)"]
-            self.report_table.heading("Slave", text="Slave")
-            self.report_table.heading("En Yüksek Anlık (m³)", text="En Yüksek Anlık (m³)")
-            self.report_table.column("Slave", width=160, anchor="center")
-            self.report_table.column("En Yüksek Anlık (m³)", width=200, anchor="center")
             try:
                 threshold = int(self.threshold_var.get())
             except Exception:
                 threshold = 300  # Default
             row = fetch_peak_with_threshold(threshold)
             if row:
-                self.report_table.insert(
-                    "", "end",
-                    values=(f"Slave {row[0]}", f"{row[1]:.2f} m³ ({row[2][:16]})")
-                )
-                self.report_table.tag_configure('pik', background="#ffe082")
-                last = self.report_table.get_children()[-1]
-                self.report_table.item(last, tags=('pik',))
+                self.report_table.set_data(["Slave", "En Yüksek Anlık (m³)"],
+                                           [[f"Slave {row[0]}", f"{row[1]:.2f} m³ ({row[2][:16]})"]],
+                                           widths=[160, 200], row_tags={0: ('pik',)})
             else:
-                self.report_table.insert("", "end", values=("", f"Eşik üstü değer yok (>{threshold} m³)"))
+                self.report_table.set_data(["Slave", "En Yüksek Anlık (m³)"],
+                                           [["", f"Eşik üstü değer yok (>{threshold} m³)"]], widths=[160, 200])
         if x_labels and total_vals and period not in ["Aylık", "Trend Grafiği"]:
-            self.ax.bar(x_labels, total_vals, color="#1976d2")
-            self.ax.set_title(f"{period} Toplam Su Tüketimi")
-            self.ax.set_xlabel("Zaman")
-            self.ax.set_ylabel("Tüketim (m³)")
-            self.fig.tight_layout()
-            self.canvas.draw()
+            self.chart.show(x_labels, total_vals, title=f"{period} Toplam Su Tüketimi",
+                            xlabel="Zaman", ylabel="Tüketim (m³)")
             self.graph_widget.pack(padx=22, pady=10)
 
 if __name__ == "__main__":
-    import sys
+    import argparse
+    multiprocessing.freeze_support()
+    parser = argparse.ArgumentParser(description="M-Bus")
+    parser.add_argument("--simulate", type=int, metavar="PORT",
+                        help="arayüz yerine TCP M-Bus simülatörünü bu portta çalıştır")
+    parser.add_argument("--query-api", type=int, metavar="PORT",
+                        help="arayüz olmadan yalnızca salt-okunur sorgu API'sini çalıştır")
+    parser.add_argument("--build-columnar", action="store_true",
+                        help="readings tablosundan kolon deposunu (mbus_columns/) oluştur")
+    parser.add_argument("--sweep-bench", metavar="SPEC", nargs="?", const="sim://8",
+                        help="tüm slave'ler ortak en düşük hızdayken ve hızlar müzakere edilmişken tur sürelerini karşılaştır (varsayılan sim://8)")
+    args = parser.parse_args()
+    if args.build_columnar:
+        init_db()
+        counts = build_columnar_store()
+        print(f"Kolon deposu: {len(counts)} slave, {sum(counts.values())} kayıt -> {COLUMNAR_DIR}/")
+        sys.exit(0)
+    if args.sweep_bench:
+        import tempfile
+        # ölçüm simüle hat hızlarını gerçek veritabanına yazmasın
+        bench_dir = tempfile.TemporaryDirectory()
+        DB_PATH = os.path.join(bench_dir.name, "sweep_bench.db")
+        init_db()
+        bench = open_transport(args.sweep_bench)
+        if not bench.supports_baud:
+            sys.exit(f"{bench.name}: hat hızı değiştirilemiyor, karşılaştırma yapılamaz")
+        poller = BusPoller(bench, range(1, NUM_SLAVES+1))
+        with redirect_stdout(io.StringIO()):
+            for addr in poller.addrs:
+                poller.detect(addr)
+        fastest = dict(poller.bauds)
+        common = min(fastest.values(), default=BAUDRATE)
+
+        def shift(targets):
+            # slave'leri verilen hızlara geçirir; geçemeyen eski hızında kalır
+            with redirect_stdout(io.StringIO()):
+                for addr, baud in targets.items():
+                    old = poller.bauds[addr]
+                    if old != baud and poller._switch(addr, old, baud):
+                        poller.bauds[addr] = baud
+
+        def run(label):
+            for n in range(3):
+                t0 = time.perf_counter()
+                with redirect_stdout(io.StringIO()):
+                    res = poller.sweep()
+                ok = sum(1 for r in res.values() if r)
+                print(f"{label}: tur {n+1} {time.perf_counter() - t0:.3f} sn, {ok}/{len(res)} slave okundu")
+
+        # taban çizgisi: tüm hat, slave'lerin ortak desteklediği en yüksek (yani en yavaşın) hızında
+        shift({addr: common for addr in fastest})
+        run(f"ortak hız {common}")
+        shift(fastest)
+        run("müzakereli")
+        print("slave hızları:", dict(sorted(poller.bauds.items())))
+        sys.exit(0)
+    if args.query_api is not None:
+        server = start_query_api(args.query_api)
+        print(f"Sorgu API: http://127.0.0.1:{server.server_address[1]}/api/latest")
+        try:
+            while True:
+                time.sleep(3600)
+        except KeyboardInterrupt:
+            sys.exit(0)
+    if args.simulate is not None:
+        sim = MBusSimulator(args.simulate)
+        print(f"M-Bus simülatörü: tcp://127.0.0.1:{sim.server_address[1]} ({len(sim.slaves)} slave)")
+        sim.serve_forever()
+        sys.exit(0)
     if sys.platform == "win32":
         import ctypes
         try:
             ctypes.windll.shcore.SetProcessDpiAwareness(1)
         except Exception:
             pass
+    if METRICS_PORT:
+        start_http_server(METRICS_PORT, DEBUG_ROUTES)
+    if QUERY_PORT:
+        start_query_api(QUERY_PORT)
+    if TRACE_PATH:
+        import atexit
+        TRACER.start()
+        atexit.register(TRACER.dump, TRACE_PATH)
     root = tk.Tk()
     app = MBusGUI(root)
     root.mainloop()